@@ -0,0 +1,36 @@
+import os,sys
+import argparse
+import time
+import metadata
+
+# declare command line parameters
+parser = argparse.ArgumentParser(description="Compares metadata reading speed of header readers and PIL",
+                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--repeat", type=int, default=3, help="Number of passes over files")
+parser.add_argument("src", help="Directory with sample media files")
+
+# runs readers over files and returns time spent and number of files with time tags
+def bench(paths,readers,repeat):
+    found=0
+    start=time.perf_counter()
+    for i in range(repeat):
+        found=0
+        for path in paths:
+            tags=metadata.read_tags(path,readers) or {}
+            if metadata.TIME_TAGS.intersection(tags):
+                found+=1
+    return time.perf_counter()-start,found
+
+# main flow
+if __name__=='__main__':
+    args = parser.parse_args()
+    paths=[os.path.join(root,name) for root,dirs,files in os.walk(args.src) for name in files]
+    if not paths:
+        print('no files in',args.src)
+        sys.exit(1)
+    for name,readers in [('headers',[r for r in metadata.readers if r is not metadata.read_pil]),
+                         ('headers+pil',metadata.readers),
+                         ('pil',[metadata.read_pil])]:
+        spent,found=bench(paths,readers,args.repeat)
+        print('{0:12} {1:8.1f} files/s {2:8.3f} ms/file {3}/{4} files with time tags'.format(
+              name,len(paths)*args.repeat/spent,spent*1000/(len(paths)*args.repeat),found,len(paths)))
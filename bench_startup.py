@@ -0,0 +1,75 @@
+import os,sys
+import argparse
+import json
+import time
+import shutil
+import statistics
+import tempfile
+import subprocess
+import fakephotos
+import bench_sync
+
+# declare command line parameters
+parser = argparse.ArgumentParser(description="Measures startup time of scripts: module import, --help and headless run against local fake Google Photos API",
+                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--repeat", type=int, default=10, help="Number of runs of every scenario")
+parser.add_argument("--json", default=None, help="File to store results as json")
+
+# directory of scripts
+HERE=os.path.dirname(os.path.abspath(__file__))
+
+# runs command repeatedly and returns wall times in seconds and exit code of the last run
+def measure(cmd,repeat,env=None):
+    times=[]
+    code=0
+    for i in range(repeat):
+        start=time.perf_counter()
+        code=subprocess.run(cmd,cwd=HERE,env=env,stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL).returncode
+        times.append(time.perf_counter()-start)
+    return times,code
+
+# headless synchronization of empty library, tokens expire in expires_in seconds
+def headless(server,workdir,expires_in,repeat):
+    keys,tokens=bench_sync.prepare_auth(workdir,server.url)
+    cmd=[sys.executable,os.path.join(HERE,'photo_albums.py'),'--keys_file',keys,'--tokens_file',tokens,
+         '--api_url',server.url,'--headless',os.path.join(workdir,'dest')]
+    env=dict(os.environ,OAUTHLIB_INSECURE_TRANSPORT='1')
+    times=[]
+    code=0
+    server.take_counters()
+    for i in range(repeat):
+        with open(tokens) as file:
+            data=json.load(file)
+        data['expires_at']=time.time()+expires_in
+        with open(tokens,'w') as file:
+            json.dump(data,file)
+        run,code=measure(cmd,1,env)
+        times+=run
+    return times,code,server.take_counters().get('token',0)
+
+# main flow
+if __name__=='__main__':
+    args = parser.parse_args()
+    results=[]
+    def add(name,times,code,extra=''):
+        results.append({'scenario':name,'exit':code,'min_ms':round(min(times)*1000,1),
+                        'median_ms':round(statistics.median(times)*1000,1),'note':extra})
+    add('python',*measure([sys.executable,'-c','pass'],args.repeat))
+    for script in ('photo_albums','photo_import','photo_auth','photo_verify'):
+        add('import '+script,*measure([sys.executable,'-c','import '+script],args.repeat))
+        add(script+' --help',*measure([sys.executable,os.path.join(HERE,script+'.py'),'--help'],args.repeat))
+    server=fakephotos.start(fakephotos.make_library(0,0))
+    workdir=tempfile.mkdtemp(prefix='bench_startup_')
+    try:
+        for name,expires_in in (('headless valid token',3600),('headless expiring token',0)):
+            times,code,tokens=headless(server,workdir,expires_in,args.repeat)
+            add(name,times,code,'{0} token refreshes'.format(tokens))
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir,ignore_errors=True)
+    print('{0:28} {1:>6} {2:>10} {3:>10}  {4}'.format('scenario','exit','min ms','median ms','note'))
+    for r in results:
+        print('{scenario:28} {exit:6} {min_ms:10.1f} {median_ms:10.1f}  {note}'.format(**r))
+    if args.json:
+        with open(args.json,'w') as file:
+            json.dump({'settings':vars(args),'results':results},file,indent=2)
@@ -0,0 +1,90 @@
+import os,sys
+import argparse
+import json
+import time
+import shlex
+import shutil
+import tempfile
+import subprocess
+import fakephotos
+
+# declare command line parameters
+parser = argparse.ArgumentParser(description="Benchmarks photo_albums.py synchronization against local fake Google Photos API",
+                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--albums", type=int, default=5, help="Number of albums")
+parser.add_argument("--items", type=int, default=200, help="Number of media items per album")
+parser.add_argument("--shared", type=float, default=0.0, help="Fraction of album items shared with the previous album")
+parser.add_argument("--size", type=int, default=256*1024, help="Average media payload size in bytes")
+parser.add_argument("--videos", type=float, default=0.0, help="Fraction of media items which are 4K videos of 20 times average size")
+parser.add_argument("--latency", type=float, default=0.02, help="Added latency of every request in seconds")
+parser.add_argument("--errors", type=float, default=0.0, help="Fraction of requests failed with 500")
+parser.add_argument("--throttle", type=float, default=0.0, help="Fraction of requests throttled with 429")
+parser.add_argument("--url_ttl", type=float, default=0.0, help="Seconds after which media baseUrls expire, 0 for never")
+parser.add_argument("--change", type=float, default=0.05, help="Fraction of media items changed for partial change scenario")
+parser.add_argument("--args", default="", help="Additional photo_albums.py arguments")
+parser.add_argument("--json", default=None, help="File to store results as json")
+parser.add_argument("--keep", action='store_true', help="Keep temporary directory with downloaded files")
+
+# writes client keys and valid tokens for fake API
+def prepare_auth(workdir,url):
+    keys=os.path.join(workdir,'keys.json')
+    tokens=os.path.join(workdir,'tokens.json')
+    with open(keys,'w') as file:
+        json.dump({'installed':{'client_id':'bench','client_secret':'bench','token_uri':url+'/token'}},file)
+    with open(tokens,'w') as file:
+        json.dump({'access_token':'fake-access','token_type':'Bearer','refresh_token':'fake-refresh',
+                   'expires_in':3600,'expires_at':time.time()+3600,
+                   'scope':['https://www.googleapis.com/auth/photoslibrary.readonly']},file)
+    return keys,tokens
+
+# runs one synchronization and collects its measurements
+def run_sync(name,server,workdir,extra):
+    keys,tokens=prepare_auth(workdir,server.url)
+    cmd=[sys.executable,os.path.join(os.path.dirname(os.path.abspath(__file__)),'photo_albums.py'),
+         '--keys_file',keys,'--tokens_file',tokens,'--api_url',server.url,'--headless']+extra+[os.path.join(workdir,'dest')]
+    env=dict(os.environ,OAUTHLIB_INSECURE_TRANSPORT='1')
+    server.take_counters()
+    with open(os.path.join(workdir,name+'.log'),'w') as log:
+        start=time.perf_counter()
+        proc=subprocess.Popen(cmd,env=env,stdout=log,stderr=subprocess.STDOUT)
+        _,status,usage=os.wait4(proc.pid,0)
+        elapsed=time.perf_counter()-start
+        proc.returncode=os.waitstatus_to_exitcode(status)
+    counters=server.take_counters()
+    downloads=counters.get('download',0)-counters.get('errors',0)-counters.get('throttled',0)-counters.get('expired',0)
+    return {'scenario':name,
+            'seconds':round(elapsed,3),
+            'exit':proc.returncode,
+            'downloads':downloads,
+            'items_per_s':round(downloads/elapsed,1),
+            'mb_per_s':round(counters.get('bytes',0)/elapsed/1e6,2),
+            'api_calls':sum(counters.get(k,0) for k in ('albums','search','batch','download','token')),
+            'list_calls':counters.get('albums',0)+counters.get('search',0),
+            'errors':counters.get('errors',0)+counters.get('throttled',0),
+            'peak_rss_mb':round(usage.ru_maxrss/1024,1)}
+
+# main flow
+if __name__=='__main__':
+    args = parser.parse_args()
+    library=fakephotos.make_library(args.albums,args.items,args.shared,args.size,videos=args.videos)
+    server=fakephotos.start(library,latency=args.latency,errors=args.errors,throttle=args.throttle,url_ttl=args.url_ttl)
+    workdir=tempfile.mkdtemp(prefix='bench_sync_')
+    extra=shlex.split(args.args)
+    print('fake API at',server.url,'with',len(library['albums']),'albums and',len(library['media']),'media items, working in',workdir)
+    results=[]
+    try:
+        results.append(run_sync('cold',server,workdir,extra))
+        results.append(run_sync('noop',server,workdir,extra))
+        fakephotos.change_library(library,args.change)
+        results.append(run_sync('partial',server,workdir,extra))
+    finally:
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(workdir,ignore_errors=True)
+    print('{0:10} {1:>9} {2:>6} {3:>10} {4:>10} {5:>8} {6:>10} {7:>7} {8:>9}'.format(
+          'scenario','seconds','exit','downloads','items/s','MB/s','API calls','errors','RSS MB'))
+    for r in results:
+        print('{scenario:10} {seconds:9.3f} {exit:6} {downloads:10} {items_per_s:10.1f} {mb_per_s:8.2f} {api_calls:10} {errors:7} {peak_rss_mb:9.1f}'.format(**r))
+    if args.json:
+        with open(args.json,'w') as file:
+            json.dump({'settings':vars(args),'results':results},file,indent=2)
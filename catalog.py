@@ -0,0 +1,121 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+import journal
+
+# catalog database file name under destination directory
+CATALOG_NAME='catalog.db'
+
+# connection is shared between download threads
+lock=threading.RLock()
+
+# opens albums catalog creating its tables if needed
+def open_catalog(path):
+    db=sqlite3.connect(str(path),check_same_thread=False,isolation_level=None)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    db.execute('CREATE TABLE IF NOT EXISTS albums (id TEXT PRIMARY KEY, title TEXT, path TEXT, downloadTime REAL, data TEXT)')
+    db.execute('CREATE TABLE IF NOT EXISTS media (album_id TEXT, id TEXT, filename TEXT, size INTEGER, downloadTime REAL, data TEXT, PRIMARY KEY (album_id,id))')
+    return db
+
+# gets catalog meta value
+def get_meta(db,key,default=None):
+    with lock:
+        row=db.execute('SELECT value FROM meta WHERE key=?',(key,)).fetchone()
+    return row[0] if row else default
+
+# sets catalog meta value
+def set_meta(db,key,value):
+    with lock:
+        db.execute('INSERT OR REPLACE INTO meta (key,value) VALUES (?,?)',(key,value))
+
+# loads albums without their media items
+def load_albums(db):
+    albums={}
+    with lock:
+        rows=db.execute('SELECT data,path,downloadTime FROM albums').fetchall()
+    for data,path,download_time in rows:
+        album=json.loads(data)
+        album['path']=path
+        album['downloadTime']=download_time or 0
+        albums[album['id']]=album
+    return albums
+
+# loads album media items
+def load_media(db,album_id):
+    with lock:
+        rows=db.execute('SELECT data FROM media WHERE album_id=?',(album_id,)).fetchall()
+    items={}
+    for data, in rows:
+        media=json.loads(data)
+        items[media['id']]=media
+    return items
+
+# loads sizes of album media files known to catalog
+def load_sizes(db,album_id):
+    with lock:
+        rows=db.execute('SELECT id,size FROM media WHERE album_id=?',(album_id,)).fetchall()
+    return {id:size for id,size in rows if size is not None}
+
+# stores album data except its media items
+def store_album(db,album):
+    data={k:v for k,v in album.items() if k not in ('mediaItems','path','downloadTime')}
+    with lock:
+        db.execute('INSERT OR REPLACE INTO albums (id,title,path,downloadTime,data) VALUES (?,?,?,?,?)',
+                   (album['id'],album.get('title'),album.get('path'),album.get('downloadTime',0),json.dumps(data)))
+
+# stores single album media item
+def store_media(db,album_id,media,size=None,download_time=None):
+    with lock:
+        if size is None or download_time is None:
+            row=db.execute('SELECT size,downloadTime FROM media WHERE album_id=? AND id=?',(album_id,media['id'])).fetchone()
+            if row:
+                size=row[0] if size is None else size
+                download_time=row[1] if download_time is None else download_time
+        db.execute('INSERT OR REPLACE INTO media (album_id,id,filename,size,downloadTime,data) VALUES (?,?,?,?,?,?)',
+                   (album_id,media['id'],media.get('filename'),size,download_time,json.dumps(media)))
+
+# removes album media items which are not in keep
+def remove_media(db,album_id,keep):
+    with lock:
+        ids=[row[0] for row in db.execute('SELECT id FROM media WHERE album_id=?',(album_id,))]
+        db.executemany('DELETE FROM media WHERE album_id=? AND id=?',[(album_id,id) for id in ids if id not in keep])
+
+# imports album.json files found in destination
+def import_json(db,dest):
+    num=0
+    for path in Path(dest).rglob('album.json'):
+        try:
+            with path.open() as file:
+                album=json.load(file)
+        except Exception as error:
+            print('failed to import',path,error)
+            continue
+        album['path']=str(path.absolute().parent)
+        album.setdefault('downloadTime',0)
+        # file size is the best known value for existing files
+        with lock:
+            db.execute('BEGIN')
+            store_album(db,album)
+            for media in album.get('mediaItems',{}).values():
+                file=path.parent/media['filename'] if 'filename' in media else None
+                size=file.stat().st_size if file and file.exists() else None
+                store_media(db,album['id'],media,size,album['downloadTime'])
+            db.execute('COMMIT')
+        num+=1
+    set_meta(db,'imported','1')
+    return num
+
+# exports catalog albums to album.json files in their directories
+def export_json(db):
+    num=0
+    for id,album in load_albums(db).items():
+        album['mediaItems']=load_media(db,id)
+        path=Path(album['path'])
+        if not path.is_dir():
+            continue
+        journal.write_snapshot(path,album)
+        num+=1
+    return num
@@ -0,0 +1,58 @@
+import os
+import json
+import time
+from pathlib import Path
+
+# album synchronization progress kept across runs so interrupted sync of huge album continues
+# where it stopped instead of listing the album from its first page again
+# append-only json lines file: start record and then one record per completed listing page
+# with the page token to continue from and ids of media items confirmed by the page
+
+# checkpoint file name under album directory
+CHECKPOINT_NAME='album.checkpoint'
+
+# loads album checkpoint, None if there is none, it is older than max_age seconds or empty
+def load(path,max_age=None):
+    state=None
+    try:
+        file=(Path(path)/CHECKPOINT_NAME).open()
+    except FileNotFoundError:
+        return None
+    with file:
+        for line in file:
+            try:
+                record=json.loads(line)
+            except ValueError:
+                # torn last line of killed process
+                continue
+            if 'started' in record:
+                state={'started':record['started'],'pageToken':None,'confirmed':set()}
+            elif state is not None and 'pageToken' in record:
+                state['pageToken']=record['pageToken']
+                state['confirmed'].update(record.get('confirmed',[]))
+    if state is None or not state['pageToken']:
+        return None
+    if max_age is not None and time.time()-state['started']>max_age:
+        return None
+    return state
+
+# opens album checkpoint, continues given state or starts a new one
+def open_checkpoint(path,state=None):
+    if state is not None:
+        return (Path(path)/CHECKPOINT_NAME).open('a',buffering=1)
+    file=(Path(path)/CHECKPOINT_NAME).open('w',buffering=1)
+    file.write(json.dumps({'started':time.time()})+'\n')
+    return file
+
+# records completed listing pages
+def add(file,token,confirmed):
+    file.write(json.dumps({'pageToken':token,'confirmed':list(confirmed)})+'\n')
+
+# removes checkpoint of completely synchronized album
+def drop(path,file=None):
+    if file is not None:
+        file.close()
+    try:
+        os.unlink(str(Path(path)/CHECKPOINT_NAME))
+    except FileNotFoundError:
+        pass
@@ -1,6 +1,189 @@
 import re
 import os,sys,stat
+import errno
+import shutil
 import filecmp
+import hashlib
+import tempfile
+import threading
+import metrics
+
+# durability of moved files: None leaves flushing to OS, 'file' syncs every moved file and its directory,
+# 'batch' syncs moved files and their directories once per SYNC_BATCH moved files, see sync_files()
+durability=None
+
+# number of moved files synchronized at once in batch durability mode
+SYNC_BATCH=256
+
+# moved files and sources of cross-device moves which are removed once their copies are synchronized
+sync_lock=threading.Lock()
+sync_state={'files':[],'sources':[]}
+
+# sets durability mode
+def set_durability(mode):
+    global durability
+    durability=None if mode in (None,'none') else mode
+
+# Linux ioctl cloning file content on copy-on-write filesystems
+FICLONE=0x40049409
+
+# copies file content in kernel: reflink if filesystem supports it, copy_file_range or sendfile otherwise
+def copy_data(srcfd,dstfd):
+    try:
+        import fcntl
+        fcntl.ioctl(dstfd,FICLONE,srcfd)
+        return 'reflink'
+    except (ImportError,OSError):
+        pass
+    size=os.fstat(srcfd).st_size
+    for method in ('copy_file_range','sendfile'):
+        if not hasattr(os,method):
+            continue
+        copied=0
+        try:
+            while copied<size:
+                if method=='copy_file_range':
+                    num=os.copy_file_range(srcfd,dstfd,size-copied)
+                else:
+                    num=os.sendfile(dstfd,srcfd,None,size-copied)
+                if num==0:
+                    break
+                copied+=num
+            return method
+        except OSError as error:
+            # not supported between these files, try next method from the start
+            if copied>0 or error.errno not in (errno.EXDEV,errno.ENOSYS,errno.EINVAL,errno.EOPNOTSUPP,errno.EBADF):
+                raise
+        os.lseek(srcfd,0,os.SEEK_SET)
+        os.lseek(dstfd,0,os.SEEK_SET)
+    with os.fdopen(os.dup(srcfd),'rb') as src,os.fdopen(os.dup(dstfd),'wb') as dst:
+        shutil.copyfileobj(src,dst,1<<20)
+    return 'copy'
+
+# copies file to another filesystem keeping its timestamps, destination appears only when its copy is complete
+# temp file name is unique so concurrent copies to the same destination do not mix
+def copy_across(srcpath,dstpath,replace=False):
+    fd,tmppath=tempfile.mkstemp(prefix='.'+os.path.basename(dstpath)+'.',suffix='.part',dir=os.path.dirname(dstpath) or '.')
+    try:
+        with os.fdopen(fd,'wb') as dst,open(srcpath,'rb') as src:
+            method=copy_data(src.fileno(),dst.fileno())
+            if durability=='file':
+                os.fsync(dst.fileno())
+        shutil.copystat(srcpath,tmppath)
+        # check copy before source is removed
+        if os.stat(tmppath).st_size!=os.stat(srcpath).st_size:
+            raise OSError(errno.EIO,'copied file size does not match',dstpath)
+        if replace:
+            os.replace(tmppath,dstpath)
+        else:
+            os.link(tmppath,dstpath)
+    finally:
+        if os.path.lexists(tmppath):
+            os.unlink(tmppath)
+    metrics.count('cross_device_moves_total',method=method)
+
+# moves file, copies it if destination is on another filesystem
+# existing destination is kept unless replace is set
+def move_path(srcpath,dstpath,replace=False):
+    try:
+        if replace:
+            os.replace(srcpath,dstpath)
+        else:
+            os.link(srcpath,dstpath)
+            os.unlink(srcpath)
+        moved(dstpath)
+    except OSError as error:
+        if error.errno!=errno.EXDEV:
+            raise
+        copy_across(srcpath,dstpath,replace)
+        moved(dstpath,srcpath)
+
+# moves file unless destination exists, returns False if it does
+# destination is created exclusively where hard links are supported, so concurrent movers never overwrite each other
+def move_new(srcpath,dstpath):
+    try:
+        move_path(srcpath,dstpath)
+    except FileExistsError:
+        return False
+    except OSError as error:
+        # no hard links on destination filesystem
+        if error.errno not in (errno.EPERM,errno.ENOTSUP,errno.EOPNOTSUPP):
+            raise
+        if os.path.exists(dstpath):
+            return False
+        move_path(srcpath,dstpath,True)
+    return True
+
+# makes moved file durable according to durability mode, removes source of copied file once it is safe
+def moved(dstpath,srcpath=None):
+    if durability=='file':
+        # copied files are synchronized while copying
+        if srcpath is None:
+            sync_file(dstpath)
+        sync_dir(os.path.dirname(dstpath))
+    if durability!='batch':
+        if srcpath is not None:
+            os.unlink(srcpath)
+        return
+    # source name is released at once, its content is kept under hidden name until the copy is synchronized
+    if srcpath is not None:
+        pending=pending_path(srcpath)
+        os.replace(srcpath,pending)
+    with sync_lock:
+        sync_state['files'].append(dstpath)
+        if srcpath is not None:
+            sync_state['sources'].append(pending)
+        if len(sync_state['files'])<SYNC_BATCH:
+            return
+    sync_files()
+
+# hidden name of source of cross-device move kept until its copy is synchronized
+def pending_path(srcpath):
+    return os.path.join(os.path.dirname(srcpath),'.'+os.path.basename(srcpath)+'.moved')
+
+# tells if file name is source of cross-device move waiting for sync, it is not imported again
+def is_pending(name):
+    return name.startswith('.') and name.endswith('.moved')
+
+# syncs file content
+def sync_file(path):
+    fd=os.open(path,os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# syncs directory entries
+def sync_dir(path):
+    fd=os.open(path or '.',os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# syncs files moved since last call and each of their directories once, removes sources of their copies
+def sync_files():
+    with sync_lock:
+        sources,sync_state['sources']=sync_state['sources'],[]
+        files,sync_state['files']=sync_state['files'],[]
+        dirs={}
+        for path in files:
+            # file could be moved on meanwhile, e.g. renamed or removed as excessive
+            try:
+                sync_file(path)
+            except FileNotFoundError:
+                pass
+            dirs[os.path.dirname(path)]=True
+        for path in dirs:
+            try:
+                sync_dir(path)
+            except FileNotFoundError:
+                pass
+    for srcpath in sources:
+        try:
+            os.unlink(srcpath)
+        except FileNotFoundError:
+            pass
 
 # moves file with checks
 def move_file(srcpath,dstpath,allow_suffix=True):
@@ -14,12 +197,13 @@ def move_file(srcpath,dstpath,allow_suffix=True):
     os.makedirs(os.path.dirname(dstpath),exist_ok=True)
     # move file if it does not exist
     if not os.path.exists(dstpath):
-        os.link(srcpath,dstpath)
-        os.unlink(srcpath)
+        move_path(srcpath,dstpath)
+        metrics.count('move_file_total',outcome='moved')
         return dstpath
     # the same file, delete source
     if filecmp.cmp(srcpath,dstpath):
         os.unlink(srcpath)
+        metrics.count('move_file_total',outcome='duplicate')
         return dstpath
     # check if directory
     dststat=os.stat(dstpath)
@@ -33,6 +217,7 @@ def move_file(srcpath,dstpath,allow_suffix=True):
             if newdest:
                 return newdest
         print('can not move '+srcpath+' to '+dstpath)
+        metrics.count('move_file_total',outcome='failed')
     # la problema
     return None
 
@@ -40,4 +225,97 @@ def move_file(srcpath,dstpath,allow_suffix=True):
 def compare_dict(a, b, ignore_keys={}):
     ka = set(a).difference(ignore_keys)
     kb = set(b).difference(ignore_keys)
-    return ka == kb and all(a[k] == b[k] for k in ka)
\ No newline at end of file
+    return ka == kb and all(a[k] == b[k] for k in ka)
+
+# links file to destination replacing existing one
+def link_file(srcpath,dstpath):
+    os.makedirs(os.path.dirname(dstpath),exist_ok=True)
+    tmppath=dstpath+'.link'
+    if os.path.lexists(tmppath):
+        os.unlink(tmppath)
+    os.link(srcpath,tmppath)
+    os.replace(tmppath,dstpath)
+    return dstpath
+
+# builds content index of files under root except skip subtree, it maps file sizes to paths and directories to file names
+def index_files(root,depth=16,skip=None):
+    index={'sizes':{},'files':{},'names':{},'hashes':{}}
+    def scan(path,depth):
+        if depth==0 or path==skip:
+            return
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    scan(entry.path,depth-1)
+                elif entry.is_file(follow_symlinks=False):
+                    index_add(index,entry.path,entry.stat().st_size)
+    if os.path.isdir(root):
+        scan(root,depth)
+    return index
+
+# adds file to index
+def index_add(index,path,size=None):
+    if size is None:
+        size=os.stat(path).st_size
+    index_remove(index,path)
+    index['files'][path]=size
+    index['sizes'].setdefault(size,set()).add(path)
+    index['names'].setdefault(os.path.dirname(path),set()).add(os.path.basename(path))
+
+# removes file from index
+def index_remove(index,path):
+    if path in index['files']:
+        index['sizes'][index['files'].pop(path)].discard(path)
+    index['names'].get(os.path.dirname(path),set()).discard(os.path.basename(path))
+    index['hashes'].pop(path,None)
+
+# gets partial (first 64KB) or full content hash of file, indexed files hashes are remembered
+def index_hash(index,path,full):
+    hashes=index['hashes'].get(path,[None,None])
+    if hashes[full] is None:
+        digest=hashlib.sha256()
+        with open(path,'rb') as f:
+            if full:
+                for chunk in iter(lambda: f.read(1<<20),b''):
+                    digest.update(chunk)
+            else:
+                digest.update(f.read(1<<16))
+        hashes[full]=digest.hexdigest()
+        if path in index['files']:
+            index['hashes'][path]=hashes
+    return hashes[full]
+
+# finds indexed file with the same content as path
+def index_find(index,path):
+    size=os.stat(path).st_size
+    candidates=index['sizes'].get(size)
+    if not candidates:
+        return None
+    # compare partial hashes first and full hashes of matching files only
+    for full in (False,True):
+        digest=index_hash(index,path,full)
+        matches=set()
+        for candidate in candidates:
+            # file itself is not its duplicate
+            if candidate==path:
+                continue
+            try:
+                if index_hash(index,candidate,full)==digest:
+                    matches.add(candidate)
+            except OSError:
+                index_remove(index,candidate)
+        if not matches:
+            return None
+        candidates=matches
+    return next(iter(candidates))
+
+# gets first destination path or its '_copyNN' variant not used in index
+def index_free_name(index,dstpath,count=32):
+    names=index['names'].get(os.path.dirname(dstpath),set())
+    if os.path.basename(dstpath) not in names:
+        return dstpath
+    for i in range(1,count):
+        newdest="{0}_copy{2}{1}".format(*(os.path.splitext(dstpath)),i)
+        if os.path.basename(newdest) not in names:
+            return newdest
+    return None
@@ -0,0 +1,307 @@
+import argparse
+import json
+import time
+import random
+import threading
+import http.server
+from urllib.parse import urlparse,parse_qs
+
+# local stand-in of Google Photos Library API for tests and benchmarks
+# implements albums listing, paged mediaItems:search, mediaItems:batchGet, media downloads with Range and If-Range support,
+# expiring media URLs and token refresh
+
+# declare command line parameters
+parser = argparse.ArgumentParser(description="Runs local fake Google Photos API server",
+                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--host", default="127.0.0.1", help="Host to listen on")
+parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+parser.add_argument("--albums", type=int, default=3, help="Number of albums")
+parser.add_argument("--items", type=int, default=100, help="Number of media items per album")
+parser.add_argument("--shared", type=float, default=0.0, help="Fraction of album items shared with the previous album")
+parser.add_argument("--size", type=int, default=256*1024, help="Average media payload size in bytes")
+parser.add_argument("--videos", type=float, default=0.0, help="Fraction of new media items which are 4K videos of 20 times average size")
+parser.add_argument("--latency", type=float, default=0.0, help="Added latency of every request in seconds")
+parser.add_argument("--errors", type=float, default=0.0, help="Fraction of requests failed with 500")
+parser.add_argument("--throttle", type=float, default=0.0, help="Fraction of requests throttled with 429")
+parser.add_argument("--url_ttl", type=float, default=0.0, help="Seconds after which media baseUrls expire, 0 for never")
+parser.add_argument("--seed", type=int, default=0, help="Random seed of generated library")
+
+# builds media item data, filenames are numbered apart from id suffix which photo_albums.py adds to names in conflict
+def make_media(id,size,created,video=False):
+    if video:
+        return {'id':id,
+                'filename':'VID_{0:04d}.mp4'.format(int(id[len('media'):])),
+                'mimeType':'video/mp4',
+                'description':'',
+                'mediaMetadata':{'creationTime':created,'width':'3840','height':'2160','video':{'fps':30,'status':'READY'}},
+                'size':size}
+    return {'id':id,
+            'filename':'IMG_{0:04d}.jpg'.format(int(id[len('media'):])),
+            'mimeType':'image/jpeg',
+            'description':'',
+            'mediaMetadata':{'creationTime':created,'width':'4000','height':'3000','photo':{}},
+            'size':size}
+
+# builds library of albums with media items
+def make_library(albums=3,items=100,shared=0.0,size=256*1024,seed=0,videos=0.0):
+    rnd=random.Random(seed)
+    library={'albums':[],'media':{},'items':{}}
+    num=0
+    for a in range(albums):
+        album={'id':'album{0:06d}'.format(a),'title':'Album {0}'.format(a),'productUrl':'','isWriteable':False}
+        ids=[]
+        previous=library['items'].get(library['albums'][-1]['id'],[]) if library['albums'] else []
+        for i in range(items):
+            if previous and rnd.random()<shared:
+                id=rnd.choice(previous)
+                if id in ids:
+                    continue
+            else:
+                id='media{0:012d}'.format(num)
+                num+=1
+                # videos draw their own random number only if asked for, libraries of the same seed stay the same
+                if videos>0 and rnd.random()<videos:
+                    library['media'][id]=make_media(id,max(1,int(rnd.expovariate(1/size)*20)),'2020-01-01T00:00:00Z',True)
+                else:
+                    library['media'][id]=make_media(id,max(1,int(rnd.expovariate(1/size))),'2020-01-01T00:00:00Z')
+            ids.append(id)
+        library['items'][album['id']]=ids
+        library['albums'].append(album)
+    return library
+
+# changes fraction of media items: updates some, removes some and adds new ones
+def change_library(library,fraction=0.1,seed=1):
+    rnd=random.Random(seed)
+    num=len(library['media'])
+    for album in library['albums']:
+        ids=library['items'][album['id']]
+        for i in rnd.sample(range(len(ids)),int(len(ids)*fraction)):
+            op=rnd.random()
+            media=library['media'][ids[i]]
+            if op<0.4:
+                media['description']='changed {0}'.format(rnd.random())
+                media['size']=media['size']+1
+            elif op<0.7:
+                ids[i]=None
+            else:
+                id='media{0:012d}'.format(num)
+                num+=1
+                library['media'][id]=make_media(id,media['size'],'2021-01-01T00:00:00Z')
+                ids.append(id)
+        library['items'][album['id']]=[id for id in ids if id is not None]
+
+# deterministic media content of given size
+def media_content(id,size):
+    head=(id+'\n').encode()
+    return (head*(size//len(head)+1))[:size]
+
+# fake API request handler
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version='HTTP/1.1'
+
+    def log_message(self,format,*args):
+        pass
+
+    def send_json(self,code,data,headers={}):
+        body=json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(body)))
+        for k,v in headers.items():
+            self.send_header(k,v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    # applies latency and injected failures, returns True if request is failed
+    def inject(self,endpoint):
+        server=self.server
+        server.count(endpoint)
+        if server.latency>0:
+            time.sleep(server.latency)
+        r=server.random()
+        if r<server.throttle:
+            server.count('throttled')
+            self.send_json(429,{'error':{'code':429,'status':'RESOURCE_EXHAUSTED'}},{'Retry-After':'1'})
+            return True
+        if r<server.throttle+server.errors:
+            server.count('errors')
+            self.send_json(500,{'error':{'code':500,'status':'INTERNAL'}})
+            return True
+        return False
+
+    def base_url(self):
+        return 'http://{0}:{1}'.format(*self.server.server_address[:2])
+
+    def read_body(self):
+        length=int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    # builds media item as returned by API
+    def media_item(self,id):
+        media=dict(self.server.library['media'][id])
+        media.pop('size')
+        media['baseUrl']=self.base_url()+'/media/'+str(int(time.time()))+'/'+id
+        return media
+
+    # pages list by offset token, None if token is not valid
+    def page(self,items,size,token):
+        if token and not token.isdigit():
+            self.send_json(400,{'error':{'code':400,'status':'INVALID_ARGUMENT','message':'Invalid page token'}})
+            return None,None
+        start=int(token) if token else 0
+        end=start+size
+        return items[start:end],(str(end) if end<len(items) else None)
+
+    def do_GET(self):
+        url=urlparse(self.path)
+        query=parse_qs(url.query)
+        library=self.server.library
+        if url.path=='/v1/albums':
+            if self.inject('albums'):
+                return
+            size=min(int(query.get('pageSize',['20'])[0]),50)
+            albums,token=self.page(library['albums'],size,query.get('pageToken',[None])[0])
+            if albums is None:
+                return
+            data={'albums':[]}
+            for album in albums:
+                items=library['items'][album['id']]
+                album=dict(album,mediaItemsCount=str(len(items)))
+                if items:
+                    album['coverPhotoMediaItemId']=items[0]
+                    album['coverPhotoBaseUrl']=self.base_url()+'/media/'+items[0]
+                data['albums'].append(album)
+            if token:
+                data['nextPageToken']=token
+            self.send_json(200,data)
+        elif url.path.startswith('/media/') and url.path.endswith('=d'):
+            if self.inject('download'):
+                return
+            stamp,_,id=url.path[len('/media/'):-2].rpartition('/')
+            # media URLs expire after url_ttl seconds
+            if stamp and self.server.url_ttl>0 and time.time()-int(stamp)>self.server.url_ttl:
+                self.server.count('expired')
+                self.send_json(403,{'error':{'code':403,'status':'PERMISSION_DENIED'}})
+                return
+            if id not in library['media']:
+                self.send_json(404,{'error':{'code':404,'status':'NOT_FOUND'}})
+                return
+            content=media_content(id,library['media'][id]['size'])
+            # content depends on id and size only
+            etag='"{0}-{1}"'.format(id,len(content))
+            start=0
+            crange=self.headers.get('Range','')
+            # range of changed content is not sent, whole new content is
+            if self.headers.get('If-Range',etag)!=etag:
+                crange=''
+            if crange.startswith('bytes=') and crange.endswith('-'):
+                start=int(crange[6:-1])
+                if start>=len(content):
+                    self.send_response(416)
+                    self.send_header('Content-Length','0')
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header('Content-Range','bytes {0}-{1}/{2}'.format(start,len(content)-1,len(content)))
+            else:
+                self.send_response(200)
+            self.send_header('Content-Type',library['media'][id]['mimeType'])
+            self.send_header('ETag',etag)
+            self.send_header('Content-Length',str(len(content)-start))
+            self.end_headers()
+            self.wfile.write(content[start:])
+            self.server.count('bytes',len(content)-start)
+        elif url.path=='/v1/mediaItems:batchGet':
+            if self.inject('batch'):
+                return
+            ids=query.get('mediaItemIds',[])
+            if not ids or len(ids)>50:
+                self.send_json(400,{'error':{'code':400,'status':'INVALID_ARGUMENT'}})
+                return
+            results=[]
+            for id in ids:
+                if id in library['media']:
+                    results.append({'mediaItem':self.media_item(id)})
+                else:
+                    results.append({'status':{'code':5,'message':'NOT_FOUND'}})
+            self.send_json(200,{'mediaItemResults':results})
+        else:
+            self.send_json(404,{'error':{'code':404,'status':'NOT_FOUND'}})
+
+    def do_POST(self):
+        url=urlparse(self.path)
+        query=parse_qs(url.query)
+        library=self.server.library
+        body=self.read_body()
+        if url.path=='/v1/mediaItems:search':
+            if self.inject('search'):
+                return
+            data=json.loads(body or b'{}')
+            items=library['items'].get(data.get('albumId'))
+            if items is None:
+                self.send_json(400,{'error':{'code':400,'status':'INVALID_ARGUMENT'}})
+                return
+            size=min(int(data.get('pageSize',25)),100)
+            ids,token=self.page(items,size,data.get('pageToken') or query.get('pageToken',[None])[0])
+            if ids is None:
+                return
+            data={'mediaItems':[self.media_item(id) for id in ids]} if ids else {}
+            if token:
+                data['nextPageToken']=token
+            self.send_json(200,data)
+        elif url.path=='/token':
+            self.server.count('token')
+            self.send_json(200,{'access_token':'fake-access','token_type':'Bearer','expires_in':3600,
+                                'refresh_token':'fake-refresh','scope':['https://www.googleapis.com/auth/photoslibrary.readonly']})
+        else:
+            self.send_json(404,{'error':{'code':404,'status':'NOT_FOUND'}})
+
+# fake API server with library, failure injection settings and request counters
+class Server(http.server.ThreadingHTTPServer):
+    daemon_threads=True
+
+    def __init__(self,address,library,latency=0.0,errors=0.0,throttle=0.0,seed=0,url_ttl=0.0):
+        super().__init__(address,Handler)
+        self.library=library
+        self.latency=latency
+        self.errors=errors
+        self.throttle=throttle
+        self.url_ttl=url_ttl
+        self.rnd=random.Random(seed)
+        self.lock=threading.Lock()
+        self.counters={}
+
+    def random(self):
+        with self.lock:
+            return self.rnd.random()
+
+    def count(self,name,value=1):
+        with self.lock:
+            self.counters[name]=self.counters.get(name,0)+value
+
+    # returns and resets request counters
+    def take_counters(self):
+        with self.lock:
+            counters,self.counters=self.counters,{}
+        return counters
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self.server_address[:2])
+
+# starts server on background thread
+def start(library,host='127.0.0.1',port=0,**kwargs):
+    server=Server((host,port),library,**kwargs)
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    return server
+
+# main flow
+if __name__=='__main__':
+    args = parser.parse_args()
+    library=make_library(args.albums,args.items,args.shared,args.size,args.seed,args.videos)
+    server=Server((args.host,args.port),library,args.latency,args.errors,args.throttle,args.seed,args.url_ttl)
+    print('fake Google Photos API at',server.url,'with',len(library['albums']),'albums and',len(library['media']),'media items')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
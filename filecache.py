@@ -0,0 +1,54 @@
+import os
+import sqlite3
+from datetime import datetime
+
+# default cache database file name under import destination
+CACHE_NAME='.import_cache.db'
+
+# number of changes between commits
+COMMIT_EVERY=256
+
+# opens import cache creating its table if needed
+def open_cache(path):
+    db=sqlite3.connect(str(path))
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    db.execute('CREATE TABLE IF NOT EXISTS files (dev INTEGER, ino INTEGER, size INTEGER, mtime INTEGER, path TEXT, time TEXT, dest TEXT, PRIMARY KEY (dev,ino,size,mtime))')
+    return db
+
+# file identity key
+def file_key(st):
+    return (st.st_dev,st.st_ino,st.st_size,st.st_mtime_ns)
+
+# gets cached creation time of file or None
+def get_time(db,st):
+    row=db.execute('SELECT time FROM files WHERE dev=? AND ino=? AND size=? AND mtime=?',file_key(st)).fetchone()
+    return datetime.fromisoformat(row[0]) if row else None
+
+# stores creation time and destination of file
+def put_time(db,st,path,time,dest=None):
+    db.execute('INSERT OR REPLACE INTO files (dev,ino,size,mtime,path,time,dest) VALUES (?,?,?,?,?,?,?)',
+               file_key(st)+(path,time.isoformat(),dest))
+    if db.total_changes%COMMIT_EVERY==0:
+        db.commit()
+
+# removes all entries
+def clear(db):
+    num=db.execute('DELETE FROM files').rowcount
+    db.commit()
+    return num
+
+# removes entries of files which no longer exist or changed
+def compact(db):
+    stale=[]
+    for key in db.execute('SELECT dev,ino,size,mtime,path FROM files').fetchall():
+        try:
+            if file_key(os.stat(key[4]))==key[:4]:
+                continue
+        except OSError:
+            pass
+        stale.append(key[:4])
+    db.executemany('DELETE FROM files WHERE dev=? AND ino=? AND size=? AND mtime=?',stale)
+    db.commit()
+    db.execute('VACUUM')
+    return len(stale)
@@ -0,0 +1,35 @@
+import os
+import sqlite3
+
+# default hash cache database file name under verified destination
+CACHE_NAME='.verify_cache.db'
+
+# number of changes between commits
+COMMIT_EVERY=256
+
+# opens hash cache creating its table if needed
+def open_cache(path):
+    db=sqlite3.connect(str(path),check_same_thread=False)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    db.execute('CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, hash TEXT, checked REAL)')
+    return db
+
+# gets recorded hash of file if its size and mtime did not change since it was hashed
+def get_hash(db,path,st):
+    row=db.execute('SELECT hash FROM hashes WHERE path=? AND size=? AND mtime=?',(path,st.st_size,st.st_mtime_ns)).fetchone()
+    return row[0] if row else None
+
+# records file hash
+def put_hash(db,path,st,digest,checked):
+    db.execute('INSERT OR REPLACE INTO hashes (path,size,mtime,hash,checked) VALUES (?,?,?,?,?)',
+               (path,st.st_size,st.st_mtime_ns,digest,checked))
+    if db.total_changes%COMMIT_EVERY==0:
+        db.commit()
+
+# removes entries of files which no longer exist
+def compact(db):
+    stale=[(path,) for path, in db.execute('SELECT path FROM hashes').fetchall() if not os.path.exists(path)]
+    db.executemany('DELETE FROM hashes WHERE path=?',stale)
+    db.commit()
+    return len(stale)
@@ -0,0 +1,89 @@
+import os
+import json
+from pathlib import Path
+
+# album state is kept as album.json snapshot and append-only journal of changes since the snapshot
+# every journal line is json record: album data without media items or single media item
+# journal is compacted into the snapshot at the end of album synchronization and replayed on start
+
+# album snapshot file name
+SNAPSHOT_NAME='album.json'
+
+# album journal file name
+JOURNAL_NAME='album.journal'
+
+# temp file name of snapshot being written
+SNAPSHOT_TMP=SNAPSHOT_NAME+'.tmp'
+
+# writes album snapshot atomically
+def write_snapshot(path,album):
+    path=Path(path)
+    tmp=path/SNAPSHOT_TMP
+    with tmp.open('w') as file:
+        json.dump(album,file,indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(str(tmp),str(path/SNAPSHOT_NAME))
+
+# opens album journal for appending and records album data
+def open_journal(path,album):
+    file=(Path(path)/JOURNAL_NAME).open('a',buffering=1)
+    file.write(json.dumps({'album':{k:v for k,v in album.items() if k!='mediaItems'}})+'\n')
+    return file
+
+# records media item, one line per write so a killed process leaves at most one torn line
+def append(file,media):
+    file.write(json.dumps({'media':media})+'\n')
+
+# loads album snapshot with its journal replayed, None if there is none
+def replay(path):
+    path=Path(path)
+    album=None
+    try:
+        with (path/SNAPSHOT_NAME).open() as file:
+            album=json.load(file)
+    except FileNotFoundError:
+        pass
+    try:
+        file=(path/JOURNAL_NAME).open()
+    except FileNotFoundError:
+        return album
+    with file:
+        for line in file:
+            try:
+                record=json.loads(line)
+            except ValueError:
+                # torn last line of killed process
+                continue
+            if 'album' in record:
+                album=dict(album or {},**record['album'])
+                album.setdefault('mediaItems',{})
+            elif 'media' in record and album is not None:
+                album['mediaItems'][record['media']['id']]=record['media']
+            else:
+                continue
+            # synchronization was interrupted
+            album['complete']=False
+    return album
+
+# writes album snapshot and drops its journal
+def compact(path,album,file=None):
+    if file is not None:
+        file.close()
+    write_snapshot(path,album)
+    try:
+        os.unlink(str(Path(path)/JOURNAL_NAME))
+    except FileNotFoundError:
+        pass
+
+# replays and compacts journals left by interrupted synchronizations under dest
+def recover(dest):
+    num=0
+    for path in Path(dest).rglob(JOURNAL_NAME):
+        album=replay(path.parent)
+        if album is None or 'id' not in album:
+            print('failed to recover album journal',path)
+            continue
+        compact(path.parent,album)
+        num+=1
+    return num
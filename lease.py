@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import uuid
+import socket
+import hashlib
+import threading
+import metrics
+
+# leases of work items, e.g. source directories, claimed by workers on several hosts through shared storage
+# lease is a file created exclusively in lease directory, its holder keeps touching it and removes it when done
+# lease which was not touched for ttl seconds belongs to a dead worker and is taken over by another one
+# expiry compares file mtime with local clock, ttl should be well above clock skew of hosts
+
+# default lease directory name under import destination
+LEASE_DIR='.import_leases'
+
+# leases held by this worker
+class Leases:
+    def __init__(self,path,ttl=120.0):
+        self.path=path
+        self.ttl=ttl
+        self.owner='{0}-{1}-{2}'.format(socket.gethostname(),os.getpid(),uuid.uuid4().hex[:8])
+        os.makedirs(path,exist_ok=True)
+        self.lock=threading.Lock()
+        # lease file paths to their inodes
+        self.held={}
+        self.stop=threading.Event()
+        self.thread=threading.Thread(target=self.keep,daemon=True)
+        self.thread.start()
+
+    # lease file of work item
+    def lease_path(self,key):
+        return os.path.join(self.path,hashlib.sha1(key.encode()).hexdigest()+'.lease')
+
+    # claims work item, returns False if another worker holds it
+    def claim(self,key):
+        path=self.lease_path(key)
+        if self.create(path,key):
+            return True
+        try:
+            st=os.stat(path)
+        except FileNotFoundError:
+            return self.create(path,key)
+        if time.time()-st.st_mtime<=self.ttl:
+            metrics.count('import_leases_total',result='busy')
+            return False
+        # expired lease is moved aside, only one of workers taking it over succeeds
+        stale=path+'.'+self.owner+'.stale'
+        try:
+            os.rename(path,stale)
+        except FileNotFoundError:
+            return False
+        moved=os.stat(stale)
+        if (moved.st_ino,moved.st_mtime)!=(st.st_ino,st.st_mtime):
+            # lease was claimed again after it was checked, give it back
+            try:
+                os.link(stale,path)
+            except FileExistsError:
+                pass
+            os.unlink(stale)
+            return False
+        os.unlink(stale)
+        print('lease of',key,'expired, taking it over')
+        metrics.count('import_leases_total',result='taken')
+        return self.create(path,key)
+
+    # creates lease file unless it exists
+    def create(self,path,key):
+        try:
+            fd=os.open(path,os.O_WRONLY|os.O_CREAT|os.O_EXCL,0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd,'w') as file:
+            json.dump({'owner':self.owner,'key':key,'claimed':time.time()},file)
+        with self.lock:
+            self.held[path]=os.stat(path).st_ino
+        metrics.count('import_leases_total',result='claimed')
+        return True
+
+    # touches held leases so other workers do not take them over
+    def renew(self):
+        with self.lock:
+            held=list(self.held.items())
+        for path,ino in held:
+            try:
+                if os.stat(path).st_ino!=ino:
+                    raise FileNotFoundError(path)
+                os.utime(path)
+            except FileNotFoundError:
+                print('lease',os.path.basename(path),'was taken over by another worker')
+                with self.lock:
+                    self.held.pop(path,None)
+
+    # renewal thread
+    def keep(self):
+        while not self.stop.wait(self.ttl/4):
+            self.renew()
+
+    # removes held leases, their work is done
+    def release(self):
+        with self.lock:
+            held,self.held=self.held,{}
+        for path,ino in held.items():
+            try:
+                if os.stat(path).st_ino==ino:
+                    os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    # stops renewal and releases held leases
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+        self.release()
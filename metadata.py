@@ -0,0 +1,214 @@
+import struct
+from datetime import datetime,timedelta,timezone
+
+# lightweight metadata readers which read only file headers instead of decoding images
+# each reader gets binary file object and returns dictionary of EXIF tags or None if file format is not supported
+
+# EXIF tags used to get creation time
+# https://exiftool.org/TagNames/EXIF.html
+EXIF_IFD=0x8769
+TIME_TAGS={0x0132,0x9003,0x9004,0x9010,0x9011,0x9012,0x882a}
+
+# QuickTime time epoch
+QT_EPOCH=datetime(1904,1,1,tzinfo=timezone.utc)
+
+# ISO base media file format top level boxes which can start a file
+ISO_BOXES={b'ftyp',b'moov',b'mdat',b'wide',b'free',b'skip',b'pnot'}
+
+# reads IFD entries of TIFF structure at base offset of file
+def tiff_ifd(f,base,order,offset,tags):
+    entries={}
+    f.seek(base+offset)
+    data=f.read(2)
+    if len(data)<2:
+        return entries
+    count,=struct.unpack(order+'H',data)
+    data=f.read(count*12)
+    for i in range(len(data)//12):
+        tag,type,num,value=struct.unpack(order+'HHI4s',data[i*12:i*12+12])
+        if tag in tags:
+            entries[tag]=(type,num,value)
+    # read values
+    values={}
+    for tag,(type,num,value) in entries.items():
+        # LONG, pointer to sub IFD
+        if type==4:
+            values[tag],=struct.unpack(order+'I',value)
+        # ASCII
+        elif type==2:
+            if num>4:
+                f.seek(base+struct.unpack(order+'I',value)[0])
+                value=f.read(num)
+            values[tag]=value[:num].split(b'\0',1)[0].decode('latin-1')
+        # SSHORT
+        elif type==8:
+            if num>2:
+                f.seek(base+struct.unpack(order+'I',value)[0])
+                value=f.read(num*2)
+            values[tag]=struct.unpack(order+str(num)+'h',value[:num*2])
+    return values
+
+# reads time tags of TIFF structure at base offset of file
+def tiff_tags(f,base):
+    f.seek(base)
+    head=f.read(8)
+    if head[:4] not in (b'II*\0',b'MM\0*'):
+        return None
+    order='<' if head[:2]==b'II' else '>'
+    offset,=struct.unpack(order+'I',head[4:])
+    tags=tiff_ifd(f,base,order,offset,TIME_TAGS|{EXIF_IFD})
+    if EXIF_IFD in tags:
+        tags.update(tiff_ifd(f,base,order,tags.pop(EXIF_IFD),TIME_TAGS))
+    return tags
+
+# JPEG reader, walks segments up to APP1 Exif one
+def read_jpeg(f):
+    if f.read(2)!=b'\xff\xd8':
+        return None
+    while True:
+        head=f.read(4)
+        if len(head)<4 or head[0]!=0xff:
+            return {}
+        marker=head[1]
+        size,=struct.unpack('>H',head[2:])
+        # start of scan, no more metadata
+        if marker==0xda:
+            return {}
+        if marker==0xe1:
+            pos=f.tell()
+            if f.read(6)==b'Exif\0\0':
+                return tiff_tags(f,pos+6) or {}
+            f.seek(pos)
+        f.seek(size-2,1)
+
+# TIFF based raw images reader
+def read_tiff(f):
+    return tiff_tags(f,0)
+
+# iterates ISO base media file format boxes between start and end offsets
+def iso_boxes(f,start,end):
+    pos=start
+    while end is None or pos+8<=end:
+        f.seek(pos)
+        head=f.read(8)
+        if len(head)<8:
+            return
+        size,type=struct.unpack('>I4s',head)
+        body=pos+8
+        if size==1:
+            size,=struct.unpack('>Q',f.read(8))
+            body+=8
+        elif size==0:
+            f.seek(0,2)
+            size=f.tell()-pos
+        if size<body-pos:
+            return
+        yield type,body,pos+size
+        pos+=size
+
+# reads big-endian unsigned integer of given size
+def read_uint(f,size):
+    return int.from_bytes(f.read(size),'big') if size else 0
+
+# HEIF Exif item, it is located with iinf and iloc boxes of meta box
+def heif_tags(f,start,end):
+    exif_id=None
+    locations={}
+    # meta is a full box
+    for type,body,box_end in iso_boxes(f,start+4,end):
+        if type==b'iinf':
+            f.seek(body)
+            version=f.read(4)[0]
+            count=read_uint(f,2 if version==0 else 4)
+            for infe,ibody,_ in iso_boxes(f,f.tell(),box_end):
+                if infe!=b'infe':
+                    continue
+                f.seek(ibody)
+                version=f.read(4)[0]
+                if version<2:
+                    continue
+                item_id=read_uint(f,2 if version==2 else 4)
+                f.seek(2,1)
+                if f.read(4)==b'Exif':
+                    exif_id=item_id
+        elif type==b'iloc':
+            f.seek(body)
+            version=f.read(4)[0]
+            sizes=read_uint(f,2)
+            offset_size,length_size,base_size,index_size=sizes>>12,(sizes>>8)&15,(sizes>>4)&15,sizes&15
+            count=read_uint(f,2 if version<2 else 4)
+            for i in range(count):
+                item_id=read_uint(f,2 if version<2 else 4)
+                if version in (1,2):
+                    f.seek(2,1)
+                f.seek(2,1)
+                base=read_uint(f,base_size)
+                extents=[]
+                for j in range(read_uint(f,2)):
+                    if version in (1,2):
+                        read_uint(f,index_size)
+                    extents.append((base+read_uint(f,offset_size),read_uint(f,length_size)))
+                locations[item_id]=extents
+    if exif_id is None or not locations.get(exif_id):
+        return {}
+    # Exif item starts with offset of TIFF header
+    offset,length=locations[exif_id][0]
+    f.seek(offset)
+    skip=read_uint(f,4)
+    return tiff_tags(f,offset+4+skip) or {}
+
+# MP4/QuickTime movie header creation time
+def mvhd_tags(f,start,end):
+    for type,body,_ in iso_boxes(f,start,end):
+        if type==b'mvhd':
+            f.seek(body)
+            version=f.read(4)[0]
+            seconds=read_uint(f,8 if version==1 else 4)
+            # unset creation time
+            if seconds==0:
+                return {}
+            time=QT_EPOCH+timedelta(seconds=seconds)
+            return {0x9003:time.strftime('%Y:%m:%d %H:%M:%S'),0x9011:'+00:00'}
+    return {}
+
+# MP4/MOV/HEIC reader
+def read_isobmff(f):
+    head=f.read(8)
+    if len(head)<8 or head[4:8] not in ISO_BOXES:
+        return None
+    for type,body,end in iso_boxes(f,0,None):
+        if type==b'meta':
+            tags=heif_tags(f,body,end)
+            if tags:
+                return tags
+        elif type==b'moov':
+            return mvhd_tags(f,body,end)
+    return {}
+
+# last resort reader decoding file with PIL
+def read_pil(f):
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image.open(f)._getexif()
+
+# registered readers in order of their use
+readers=[read_jpeg,read_tiff,read_isobmff,read_pil]
+
+# registers additional reader before PIL one
+def register_reader(reader,index=-1):
+    readers.insert(index if index>=0 else len(readers)+index,reader)
+
+# reads EXIF like tags dictionary of file using the first reader which supports it
+def read_tags(path,readers=readers):
+    with open(path,'rb') as f:
+        for reader in readers:
+            f.seek(0)
+            try:
+                tags=reader(f)
+            except Exception:
+                tags=None
+            if tags is not None:
+                return tags
+    return None
@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import threading
+from contextlib import nullcontext
+
+# run metrics: counters and timing histograms with labels
+# everything is a no-op until enable() is called
+
+# metrics name prefix in Prometheus textfile
+PREFIX='photo_scripts_'
+
+# histogram buckets upper bounds in seconds
+BUCKETS=(0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60,float('inf'))
+
+enabled=False
+lock=threading.Lock()
+counters={}
+histograms={}
+started=time.time()
+
+# shared disabled timer
+NOOP=nullcontext()
+
+# starts collecting metrics
+def enable():
+    global enabled,started
+    enabled=True
+    started=time.time()
+
+# metric key of name and labels
+def key(name,labels):
+    return (name,tuple(sorted((k,str(v)) for k,v in labels.items())))
+
+# increases counter
+def count(name,value=1,**labels):
+    if not enabled:
+        return
+    k=key(name,labels)
+    with lock:
+        counters[k]=counters.get(k,0)+value
+
+# records duration to histogram
+def observe(name,seconds,**labels):
+    if not enabled:
+        return
+    k=key(name,labels)
+    with lock:
+        h=histograms.get(k)
+        if h is None:
+            h=histograms[k]={'count':0,'sum':0.0,'buckets':[0]*len(BUCKETS)}
+        h['count']+=1
+        h['sum']+=seconds
+        for i,bound in enumerate(BUCKETS):
+            if seconds<=bound:
+                h['buckets'][i]+=1
+                break
+
+# measures duration of with block
+class Timer:
+    def __init__(self,name,labels):
+        self.name=name
+        self.labels=labels
+
+    def __enter__(self):
+        self.start=time.perf_counter()
+        return self
+
+    def __exit__(self,*exc):
+        observe(self.name,time.perf_counter()-self.start,**self.labels)
+
+# returns timer context of histogram, no-op context if metrics are disabled
+def timer(name,**labels):
+    return Timer(name,labels) if enabled else NOOP
+
+# measures duration of run phase
+def phase(name):
+    return timer('phase_seconds',phase=name)
+
+# builds report dictionary
+def report():
+    with lock:
+        return {'started':started,
+                'finished':time.time(),
+                'counters':[{'name':name,'labels':dict(labels),'value':value} for (name,labels),value in sorted(counters.items())],
+                'histograms':[{'name':name,'labels':dict(labels),'count':h['count'],'sum':h['sum'],
+                               'buckets':{str(b):c for b,c in zip(BUCKETS,h['buckets'])}}
+                              for (name,labels),h in sorted(histograms.items())]}
+
+# writes file atomically
+def write_file(path,text):
+    tmp=path+'.tmp'
+    with open(tmp,'w') as file:
+        file.write(text)
+    os.replace(tmp,path)
+
+# writes json report
+def write_json(path):
+    write_file(path,json.dumps(report(),indent=2))
+
+# formats Prometheus labels
+def format_labels(labels,extra=()):
+    items=list(labels)+list(extra)
+    if not items:
+        return ''
+    return '{'+','.join('{0}="{1}"'.format(k,str(v).replace('\\','\\\\').replace('"','\\"')) for k,v in items)+'}'
+
+# writes Prometheus textfile collector file
+def write_prometheus(path):
+    lines=[]
+    with lock:
+        typed=set()
+        for (name,labels),value in sorted(counters.items()):
+            if name not in typed:
+                lines.append('# TYPE {0}{1} counter'.format(PREFIX,name))
+                typed.add(name)
+            lines.append('{0}{1}{2} {3}'.format(PREFIX,name,format_labels(labels),value))
+        for (name,labels),h in sorted(histograms.items()):
+            if name not in typed:
+                lines.append('# TYPE {0}{1} histogram'.format(PREFIX,name))
+                typed.add(name)
+            total=0
+            for bound,num in zip(BUCKETS,h['buckets']):
+                total+=num
+                lines.append('{0}{1}_bucket{2} {3}'.format(PREFIX,name,format_labels(labels,[('le','+Inf' if bound==float('inf') else bound)]),total))
+            lines.append('{0}{1}_sum{2} {3}'.format(PREFIX,name,format_labels(labels),h['sum']))
+            lines.append('{0}{1}_count{2} {3}'.format(PREFIX,name,format_labels(labels),h['count']))
+    lines.append('# TYPE {0}last_run_timestamp_seconds gauge'.format(PREFIX))
+    lines.append('{0}last_run_timestamp_seconds {1}'.format(PREFIX,time.time()))
+    write_file(path,'\n'.join(lines)+'\n')
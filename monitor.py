@@ -0,0 +1,65 @@
+import json
+import threading
+import http.server
+import metrics
+
+# local HTTP endpoint of long running synchronization
+# GET /status returns progress as json, POST /sync starts synchronization right away
+
+# status request handler
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version='HTTP/1.1'
+
+    def log_message(self,format,*args):
+        pass
+
+    def send_json(self,code,data):
+        body=json.dumps(data,indent=2).encode()
+        self.send_response(code)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.partition('?')[0]!='/status':
+            self.send_json(404,{'error':'not found'})
+            return
+        data=dict(self.server.state)
+        if self.server.report is not None:
+            data.update(self.server.report())
+        if metrics.enabled:
+            data['counters']=metrics.report()['counters']
+        self.send_json(200,data)
+
+    def do_POST(self):
+        # request body is not used
+        length=int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        if self.path.partition('?')[0]!='/sync':
+            self.send_json(404,{'error':'not found'})
+            return
+        self.server.trigger.set()
+        self.send_json(202,{'triggered':True})
+
+# status server of state dictionary and sync trigger event
+class Server(http.server.ThreadingHTTPServer):
+    daemon_threads=True
+
+    def __init__(self,address,state,trigger,report=None):
+        super().__init__(address,Handler)
+        self.state=state
+        self.trigger=trigger
+        self.report=report
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self.server_address[:2])
+
+# starts status server on background thread, it listens on localhost only
+# report function adds its dictionary to status
+def start(state,trigger,port=0,report=None,host='127.0.0.1'):
+    server=Server((host,port),state,trigger,report)
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    return server
@@ -2,12 +2,29 @@ import os,sys
 import argparse
 import json
 import time
-import http.server
-import socketserver
+import queue
+import signal
+import itertools
+import threading
 from pathlib import Path
+from urllib.parse import urlencode
 from datetime import datetime,timezone
-from requests_oauthlib import OAuth2Session
+from concurrent.futures import ThreadPoolExecutor,wait,FIRST_COMPLETED
+from contextlib import nullcontext
+from typing import TYPE_CHECKING
 import common
+import catalog
+import storage
+import journal
+import checkpoint
+import ratelimit
+import metrics
+import transfer
+import workers
+
+# session type of annotations, requests_oauthlib itself is imported only when API is used
+if TYPE_CHECKING:
+    from requests_oauthlib import OAuth2Session
 
 # declare command line parameters
 parser = argparse.ArgumentParser(description="Downloads Google Photos albums trying to prevent downloading known existing files",
@@ -20,21 +37,65 @@ parser.add_argument('--redirect_proto', choices=['http', 'https'], default="http
 parser.add_argument("--redirect_host", default="localhost", help="Host to handle Google API athorization redirect")
 parser.add_argument("--redirect_port", choices=range(1,65535), metavar="[1-65535]", default=8080, help="Port to handle Google API athorization redirect")
 parser.add_argument("--tokens_file", default="tokens.json", help="Authorized tokens json file location")
+parser.add_argument("--api_url", default="https://photoslibrary.googleapis.com", help="Google Photos API base URL")
 parser.add_argument('--skip_new', action='store_true', help="Skip new Google Photos albums downloading")
+parser.add_argument('--full', action='store_true', help="Check media of all albums even if albums data are unchanged")
+parser.add_argument("--revalidate", type=float, default=7, help="Days after which media of unchanged album are checked anyway, 0 to check always")
 parser.add_argument('--headless', action='store_true', help="Run in headless mode without interactive authenfication")
+parser.add_argument("--jobs", type=int, default=4, help="Number of parallel media downloads")
+parser.add_argument("--resume", type=float, default=24, help="Hours during which interrupted album synchronization continues from its last completed page, 0 to always start over")
+parser.add_argument("--page_size", type=int, default=100, help="Number of media items requested per page, up to 100")
+parser.add_argument("--rate", type=float, default=10, help="Google API requests per second limit, 0 to disable")
+parser.add_argument('--catalog', action='store_true', help="Keep albums metadata in catalog database under destination instead of album.json files")
+parser.add_argument("--store", default=None, help="Directory to store media shared by several albums only once, must be on the same filesystem as destination")
+parser.add_argument('--store_hash', action='store_true', help="Share stored content of different media with the same content hash")
+parser.add_argument("--metrics", default=None, help="File to store json report of run metrics")
+parser.add_argument("--prometheus", default=None, help="Prometheus textfile collector file to store run metrics")
+parser.add_argument("--repair", default=None, help="Repair list made by photo_verify.py, its albums are checked and their broken media downloaded again")
+parser.add_argument("--durability", choices=['none','file','batch'], default='none', help="Sync moved files: none leaves it to OS, file syncs every file, batch syncs groups of files at once")
+parser.add_argument("--bandwidth", type=transfer.parse_limits, default=None, help="Download bandwidth limit in bytes per second with K, M or G suffix, for the whole day or by local time windows, e.g. 09:00-18:00=2M,18:00-23:00=20M")
+parser.add_argument('--export_json', action='store_true', help="Export catalog to album.json files after synchronization")
+parser.add_argument('--daemon', action='store_true', help="Keep running and synchronize albums every interval")
+parser.add_argument("--interval", type=float, default=15, help="Minutes between synchronizations in daemon mode")
+parser.add_argument("--hot_days", type=float, default=1, help="Days during which changed albums are checked by every synchronization in daemon mode")
+parser.add_argument("--status_port", type=int, default=None, help="Local port of daemon status endpoint: GET /status, POST /sync")
 parser.add_argument("destination", help="Destination download directory")
-args = parser.parse_args()
+
+# Google Photos API base URL
+API_URL='https://photoslibrary.googleapis.com'
+
+# share stored content of different media with the same content hash
+STORE_HASH=False
+
+# stored access token is used without refresh if it is valid for at least these seconds
+TOKEN_MARGIN=300
+
+# set to stop synchronization, downloads in progress are finished
+STOP=threading.Event()
+
+# download bandwidth limit, None for unlimited
+BANDWIDTH=None
+
+# queued downloads and their estimated time remaining
+BACKLOG=transfer.Backlog()
+
+# number of listed media waiting for download, the cheapest of them are downloaded first
+SCHEDULE_WINDOW=500
+
+# seconds between queued downloads reports
+REPORT_EVERY=30
 
 # prepare authorized Google API request
 # based on examples:
 # https://github.com/requests/requests-oauthlib/blob/master/docs/examples/real_world_example_with_refresh.rst
 # https://requests-oauthlib.readthedocs.io/en/latest/examples/google.html
 # https://requests-oauthlib.readthedocs.io/en/latest/oauth2_workflow.html#third-recommended-define-automatic-token-refresh-and-update
-def Authorize(args)->OAuth2Session:
+def Authorize(args)->'OAuth2Session':
+    # requests_oauthlib takes long to import, import it only when API is used
+    from requests_oauthlib import OAuth2Session
     # prepare credentials
     auth_url='https://accounts.google.com/o/oauth2/auth'
     token_url='https://oauth2.googleapis.com/token'
-    refresh_url=token_url
     creds={'client_id':'','client_secret':''}
     scopes=['https://www.googleapis.com/auth/photoslibrary.readonly']
 
@@ -56,6 +117,12 @@ def Authorize(args)->OAuth2Session:
         except:
             print('specfied keys file',args.keys_file,'does not exist or invalid')
 
+    # tokens are refreshed with the same endpoint
+    refresh_url=token_url
+    # store refreshed tokens
+    def UpdateTokens(tokens):
+        SaveTokens(tokens,args.tokens_file)
+
     # get override credentials
     if args.client_id:
         creds['client_id']=args.client_id
@@ -74,9 +141,12 @@ def Authorize(args)->OAuth2Session:
                 tokens=json.load(file);
                 if not set(scopes).issubset(set(tokens['scope'])):
                     raise Exception('invalid token scopes')
-                api=OAuth2Session(creds['client_id'],token=tokens,auto_refresh_kwargs=creds,auto_refresh_url=refresh_url,token_updater=SaveTokens)
+                api=OAuth2Session(creds['client_id'],token=tokens,auto_refresh_kwargs=creds,auto_refresh_url=refresh_url,token_updater=UpdateTokens)
+                # still valid token is refreshed automatically when it expires
+                if tokens.get('expires_at',0)-time.time()>TOKEN_MARGIN:
+                    return api
                 tokens=api.refresh_token(refresh_url)
-                SaveTokens(tokens)
+                UpdateTokens(tokens)
                 return api
         except Exception as error:
             print(error)
@@ -104,12 +174,14 @@ def Authorize(args)->OAuth2Session:
         pass
     
     # redirect user to Google for authorization
-    api=OAuth2Session(creds['client_id'],scope=scopes,redirect_uri=redirect_url,auto_refresh_kwargs=creds,auto_refresh_url=refresh_url,token_updater=SaveTokens)
+    api=OAuth2Session(creds['client_id'],scope=scopes,redirect_uri=redirect_url,auto_refresh_kwargs=creds,auto_refresh_url=refresh_url,token_updater=UpdateTokens)
     user_auth_url, state = api.authorization_url(auth_url,access_type="offline",prompt="select_account")
     print('please go here and authorize:')
     print(user_auth_url)
     
     # start listening for http redirection
+    import http.server
+    import socketserver
     handler=http.server.SimpleHTTPRequestHandler
     handler.do_GET=HttpHandle
     handler.log_message=HttpLogSilent
@@ -121,21 +193,33 @@ def Authorize(args)->OAuth2Session:
     if args.redirect_proto=='http':
         os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
     tokens=api.fetch_token(token_url,client_secret=creds['client_secret'],authorization_response=redirect_url)
-    SaveTokens(tokens)
+    UpdateTokens(tokens)
     
     # return api
     return api
 
 # save tokens
-def SaveTokens(tokens):
-    if args.tokens_file:
-       with open(args.tokens_file,mode='w') as file:
+def SaveTokens(tokens,tokens_file):
+    if tokens_file:
+       with open(tokens_file,mode='w') as file:
            json.dump(tokens,file)
 
 # load existing albums list
-def LoadAlbums(dest):
+def LoadAlbums(dest,db=None):
+    # catalog replaces album.json files after their first import
+    if db is not None:
+        if catalog.get_meta(db,'imported') is None:
+            journal.recover(dest)
+            print('album.json files imported to catalog:',catalog.import_json(db,dest))
+        albums=catalog.load_albums(db)
+        print('local albums in',dest,':',len(albums))
+        return albums
+    # replay journals of interrupted synchronizations
+    recovered=journal.recover(dest)
+    if recovered>0:
+        print('interrupted album journals recovered:',recovered)
     albums={}
-    for path in dest.rglob('album.json'):
+    for path in dest.rglob(journal.SNAPSHOT_NAME):
         with path.open() as file:
             data=json.load(file);
             items={}
@@ -154,112 +238,351 @@ def LoadIgnore(dest):
             ignore+=file.read().splitlines()
     return ignore
 
+# load repair list, maps album ids to their broken media
+def LoadRepair(path):
+    if path is None or not Path(path).exists():
+        return {}
+    with Path(path).open() as file:
+        repair=json.load(file).get('albums',{})
+    print('albums to repair:',len(repair))
+    return repair
+
+# store repair list of albums which are not repaired yet
+def StoreRepair(path,repair):
+    if path is None:
+        return
+    if not repair:
+        Path(path).unlink(missing_ok=True)
+        return
+    metrics.write_file(str(path),json.dumps({'created':datetime.now(timezone.utc).timestamp(),'albums':repair},indent=2))
+
+# number of albums synchronized at once, listing of the next album overlaps downloads of the previous one
+ALBUMS_IN_FLIGHT=2
+
 # dowload all albums
-def DowloadAlbums(api,trash,dest,old,ignore,skip_new):
+# synchronized albums become old ones for the next run, returns ids of albums which changed or None if albums are not listed
+def DowloadAlbums(api,trash,dest,old,ignore,skip_new,jobs=1,db=None,store=None,full=False,revalidate=7,page_size=100,resume=24,repair=None,hot=(),progress=None,pool=None):
+    if repair is None:
+        repair={}
+    if progress is None:
+        progress={}
     num_new=0
     num_local=0
-    nextpage='0'
+    num_unchanged=0
     new={}
-    while nextpage is not None:
-        # get album data
-        if nextpage=='0':
-            resp = api.get("https://photoslibrary.googleapis.com/v1/albums?pageSize=50")
-        else:
-            resp = api.api("https://photoslibrary.googleapis.com/v1/albums?pageSize=50&pageToken="+nextpage)
-        if resp.status_code is not 200:
-            print('failed to load albums',resp.status_code,resp.reason)
-            return
-        data = json.loads(resp.content)
-        # remember nextpage
-        if 'nextPageToken' in data:
-            nextpage=data['nextPageToken']
-        else:
-            nextpage=None
-        # store albums' data by their last download time
-        for album in data['albums']:
-            if album['id'] in old:
-                album['path']=old[album['id']]['path']
-                new[old[album['id']]['downloadTime']] = new.get(old[album['id']]['downloadTime'], [])+[album]
+    albums,status=PageItems(api,API_URL+"/v1/albums",'albums',page_size=50)
+    # store albums' data by their last download time
+    for album in albums:
+        if album['id'] in old:
+            album['path']=old[album['id']]['path']
+            # skip albums which did not change since their last complete synchronization
+            if not full and album['id'] not in repair and album['id'] not in hot and AlbumUnchanged(album,old[album['id']],revalidate):
                 num_local+=1
-            else:
-                if not skip_new:
-                    album['path']=str(dest/album['title'])
-                    new[0] = new.get(0, [])+[album]
-                num_new+=1
+                num_unchanged+=1
+                metrics.count('albums_total',result='unchanged')
+                continue
+            new[old[album['id']]['downloadTime']] = new.get(old[album['id']]['downloadTime'], [])+[album]
+            num_local+=1
+        else:
+            if not skip_new:
+                album['path']=str(dest/album['title'])
+                new[0] = new.get(0, [])+[album]
+            num_new+=1
+    if status['error'] is not None:
+        print('failed to load albums',status['error'])
+        return None
     print(f'Google Photos albums: {num_new+num_local} ({num_local} local, {num_new} new)%s' %(', new albums will be skipped' if skip_new else ''))
-    # download albums starting from the oldest downloaded
-    for k,albums in sorted(new.items()):
-        for album in albums:
-            # download only allowed albums
-            if album['title'] not in ignore and album['id'] not in ignore:
-                if album['id'] in old:
-                    DowloadAlbum(api,trash,album,old[album['id']])
+    if num_unchanged>0:
+        print('unchanged albums skipped:',num_unchanged)
+    changed=[]
+    progress['albums_total']=sum(1 for albums in new.values() for album in albums if album['title'] not in ignore and album['id'] not in ignore)
+    progress['albums_done']=0
+    # albums synchronized at once share download lane, so media of the next album are downloaded cheap first
+    # together with large media left of the previous one instead of waiting for them
+    own=workers.FairPool(jobs) if pool is None else None
+    if own is not None:
+        pool=own.lane('albums')
+    # synchronized albums with their old data and media ids
+    running={}
+    # bookkeeping of synchronized album
+    def finish(future):
+        album,old_album,before=running.pop(future)
+        res=future.result()
+        metrics.count('albums_total',result='synchronized' if res else 'failed')
+        if res:
+            repair.pop(album['id'],None)
+            if before!=set(album['mediaItems']) or not common.compare_dict(album,old_album,ALBUM_LOCAL_KEYS):
+                changed.append(album['id'])
+        # release media data, catalog keeps them
+        if db is not None:
+            del album['mediaItems']
+        old[album['id']]=album
+        progress['albums_done']+=1
+    # synchronizes album measuring its duration
+    def sync(album,old_album):
+        with metrics.timer('album_sync_seconds'):
+            return DowloadAlbum(api,trash,album,old_album,jobs,db,store,page_size,resume,pool)
+    try:
+        with ThreadPoolExecutor(max_workers=ALBUMS_IN_FLIGHT) as executor:
+            # download albums starting from the oldest downloaded
+            for k,albums in sorted(new.items()):
+                for album in albums:
+                    if STOP.is_set():
+                        break
+                    # download only allowed albums
+                    if album['title'] not in ignore and album['id'] not in ignore:
+                        # albums sharing directory are not synchronized at once
+                        while len(running)>=ALBUMS_IN_FLIGHT or any(other['path']==album['path'] for other,_,_ in running.values()):
+                            done,_=wait(running,return_when=FIRST_COMPLETED)
+                            for future in done:
+                                finish(future)
+                        progress['album']=album['title']
+                        old_album=old.get(album['id'])
+                        # catalog albums get their media on demand
+                        if old_album is not None and db is not None and 'mediaItems' not in old_album:
+                            old_album['mediaItems']=catalog.load_media(db,album['id'])
+                        before=set(old_album['mediaItems']) if old_album is not None else None
+                        # broken media are downloaded again
+                        if old_album is not None and album['id'] in repair:
+                            for id in repair[album['id']].get('media',[]):
+                                old_album['mediaItems'].pop(id,None)
+                        running[executor.submit(sync,album,old_album)]=(album,old_album,before)
+            while running:
+                done,_=wait(running,return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(future)
+    finally:
+        if own is not None:
+            own.shutdown()
+    progress['album']=None
+    return changed
+
+# streams items of paged API listing which are fetched by background thread
+# returns items iterator and status with 'error' set if listing failed
+# GET is used for listing without body, POST with json body otherwise
+def PageItems(api,url,key,body=None,page_size=100,prefetch=2,page_token=None):
+    # queue keeps up to prefetch pages so memory does not depend on listing size
+    items=queue.Queue(maxsize=prefetch*page_size)
+    # token and fetched are set to page token and fetch time of the page consumer iterates over
+    status={'error':None,'token':page_token,'fetched':None}
+    stop=threading.Event()
+    done=object()
+    # puts item to queue unless consumer stopped
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item,timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+    # fetches pages one by one
+    def produce():
+        nextpage=page_token
+        try:
+            while not stop.is_set():
+                if body is None:
+                    resp=api.get(url+'?pageSize='+str(page_size)+('&pageToken='+nextpage if nextpage else ''))
                 else:
-                    DowloadAlbum(api,trash,album,None)
+                    resp=api.post(url+('?pageToken='+nextpage if nextpage else ''),
+                                  data=json.dumps(dict(body,pageSize=page_size)),headers={'content-type':'application/json'})
+                if resp.status_code!=200:
+                    status['error']='{status} {reason}'.format(status=resp.status_code,reason=resp.reason)
+                    break
+                data=json.loads(resp.content)
+                # page start mark with its token and fetch time
+                if not put((done,nextpage,time.monotonic())):
+                    return
+                for item in data.get(key,[]):
+                    if not put(item):
+                        return
+                nextpage=data.get('nextPageToken')
+                if not nextpage:
+                    break
+        except Exception as error:
+            status['error']=str(error)
+        finally:
+            put(done)
+    # yields items until listing is over
+    def consume():
+        pager=threading.Thread(target=produce,daemon=True)
+        pager.start()
+        try:
+            while True:
+                item=items.get()
+                if item is done:
+                    return
+                if isinstance(item,tuple):
+                    status['token'],status['fetched']=item[1:]
+                    continue
+                yield item
+        finally:
+            stop.set()
+    return consume(),status
 
-# dowload album
-def DowloadAlbum(api,trash,album,old_album):
+# album fields which are not part of Google Photos album data or change without album change
+ALBUM_LOCAL_KEYS={'path','downloadTime','checkTime','complete','mediaItems','coverPhotoBaseUrl'}
+
+# check if album data are the same as of its last complete synchronization
+def AlbumUnchanged(album,old_album,revalidate):
+    if not old_album.get('complete'):
+        return False
+    # periodical full check
+    if revalidate<=0 or datetime.now(timezone.utc).timestamp()*1000-old_album.get('checkTime',0)>revalidate*86400000:
+        return False
+    return common.compare_dict(album,old_album,ALBUM_LOCAL_KEYS)
+
+# dowload album, media are downloaded by pool shared with other albums if given
+def DowloadAlbum(api,trash,album,old_album,jobs=1,db=None,store=None,page_size=100,resume=24,pool=None):
     print(album['title'],'downloading to',album['path'])
     album['mediaItems']={}
     skipped=0
     dest=Path(album['path'])
     dest.mkdir(parents=True,exist_ok=True)
-    req_body=json.dumps({"albumId": album['id'],"pageSize": 100});
-    req_headers={'content-type':'application/json'}
-    nextpage='0'
-    res=True
-    while nextpage is not None:
-        # request album data
-        if nextpage=='0':
-            resp = api.post("https://photoslibrary.googleapis.com/v1/mediaItems:search",
-                            data=req_body,headers=req_headers)
-        else:
-            resp = api.post("https://photoslibrary.googleapis.com/v1/mediaItems:search?pageToken="+nextpage,
-                            data=req_body,headers=req_headers)
-        if resp.status_code is not 200:
-            print(album['title'],'failed retrieve media list',resp.status_code,resp.reason)
-            res=False
-            break
-        items = json.loads(resp.content)
-        # prepare next token
-        if 'nextPageToken' in items:
-            nextpage=items['nextPageToken']
+    # continue interrupted synchronization from its last completed page
+    state=checkpoint.load(dest,resume*3600) if resume>0 and old_album is not None else None
+    items,status=PageItems(api,API_URL+"/v1/mediaItems:search",'mediaItems',
+                           {"albumId": album['id']},min(page_size,100),page_token=state['pageToken'] if state else None)
+    first=None
+    if state is not None:
+        first=next(items,None)
+        # page token expired, start over
+        if first is None and status['error'] is not None:
+            print(album['title'],'checkpoint is no longer valid, synchronizing from the beginning','[{0}]'.format(status['error']))
+            items.close()
+            state=None
+            items,status=PageItems(api,API_URL+"/v1/mediaItems:search",'mediaItems',
+                                   {"albumId": album['id']},min(page_size,100))
         else:
-            nextpage=None
-        # download album media
-        for media in items['mediaItems']:
-            if old_album is not None and \
-               media['id'] in old_album['mediaItems'] and \
-               CheckMedia(trash,album,media,old_album['mediaItems'][media['id']]):
-                skipped+=1
-            elif not DowloadMedia(api,trash,album,media):
+            # media confirmed by completed pages are kept as they are
+            for id in state['confirmed']:
+                if id in old_album['mediaItems']:
+                    album['mediaItems'][id]=old_album['mediaItems'][id]
+            print(album['title'],'resuming synchronization,',len(album['mediaItems']),'media items already confirmed')
+    checkpoint_file=checkpoint.open_checkpoint(dest,state)
+    # completed pages waiting for their downloads: next page token, downloads and media ids
+    marks=[]
+    token=status['token']
+    ids=[]
+    # saves progress of listed pages with all their downloads finished successfully
+    def save_progress():
+        while marks and all(f.done() and f.exception() is None and f.result() for f in marks[0][1]):
+            checkpoint.add(checkpoint_file,marks[0][0],marks[0][2])
+            marks.pop(0)
+    res=True
+    # album lock serializes filesystem decisions and album bookkeeping of parallel downloads
+    lock=threading.Lock()
+    # filenames reserved by downloads in progress
+    busy=set()
+    # album directory snapshot, kept up to date by album sync instead of checking files one by one
+    names=ScanAlbum(dest)
+    # album changes are journaled as they happen so interrupted sync loses no work
+    journal_file=journal.open_journal(dest,album) if db is None else None
+    # baseUrls of media waiting for download, their fetch times and ids of media being refreshed
+    urls={'lock':threading.Lock(),'media':{},'fetched':{},'refreshing':set()}
+    urls['refreshed']=threading.Condition(urls['lock'])
+    pending=set()
+    reported=time.monotonic()
+    with workers.FairPool(jobs) if pool is None else nullcontext() as own:
+        if pool is None:
+            pool=own.lane(album['id'])
+        # download album media while next pages are fetched
+        for media in itertools.chain([first] if first else [],items):
+            # stopping, checkpoint and journal keep progress for the next run
+            if STOP.is_set():
                 res=False
                 break
-        if not res:
-            break
+            # page is listed completely
+            if status['token']!=token:
+                marks.append((status['token'],set(pending),ids))
+                token=status['token']
+                ids=[]
+                done={f for f in pending if f.done()}
+                if not all(f.result() for f in done):
+                    res=False
+                    break
+                pending-=done
+                save_progress()
+                if pending and time.monotonic()-reported>=REPORT_EVERY:
+                    reported=time.monotonic()
+                    print(album['title'],transfer.format_report(BACKLOG.report()))
+            ids.append(media['id'])
+            with lock:
+                if old_album is not None and \
+                   media['id'] in old_album['mediaItems'] and \
+                   CheckMedia(trash,album,media,old_album['mediaItems'][media['id']],store,names):
+                    skipped+=1
+                    if journal_file is not None:
+                        journal.append(journal_file,media)
+                    metrics.count('check_media_total',result='hit')
+                    continue
+            metrics.count('check_media_total',result='miss')
+            # keep number of queued downloads bounded
+            if len(pending)>=max(2*jobs,SCHEDULE_WINDOW):
+                done,pending=wait(pending,return_when=FIRST_COMPLETED)
+                if not all(f.result() for f in done):
+                    res=False
+                    break
+                save_progress()
+            with urls['lock']:
+                urls['media'][media['id']]=media
+                urls['fetched'][media['id']]=status['fetched']
+            # cheap media go first so large videos do not hold back photos listed after them
+            size=transfer.estimate_size(media)
+            BACKLOG.add(size)
+            future=pool.submit(DowloadMedia,api,trash,album,media,lock,busy,db,store,names,journal_file,urls,priority=size)
+            future.add_done_callback(lambda f,size=size: BACKLOG.done(size))
+            pending.add(future)
+        items.close()
+        # wait for downloads in progress
+        done,pending=wait(pending)
+        if not all(f.result() for f in done):
+            res=False
+        # pages completed by the last downloads, also when stopped or failed
+        save_progress()
+    if status['error'] is not None:
+        print(album['title'],'failed retrieve media list',status['error'])
+        res=False
+    # complete synchronization needs no checkpoint, otherwise keep it for the next run
+    if res:
+        checkpoint.drop(dest,checkpoint_file)
+    else:
+        checkpoint_file.close()
     # journal skipped files
     if skipped>0:
         print(album['title'],skipped,'up to date media files skipped')
     # keep old album data
     if not res:
         if old_album is not None:
-            for media in old_album['mediaItems'].items():
-                if media['id'] not in album['mediaItems']:
-                    album['mediaItems'][media['id']]=media
+            for id,media in old_album['mediaItems'].items():
+                if id not in album['mediaItems']:
+                    album['mediaItems'][id]=media
     # set album download time and store its metadata
     album['downloadTime']=datetime.now(timezone.utc).timestamp()*1000
-    with (Path(album['path'])/'album.json').open("w") as file:
-        json.dump(album,file,indent=2)
+    album['checkTime']=album['downloadTime']
+    album['complete']=res
     # stop here if something went wrong
     if not res:
+        StoreAlbum(album,db,journal_file)
         print(album['title'],"is not completely synchronized")
         return False
     # build set of current album items filenames and remove any excess files from directory
-    filenames={'album.json'}
+    filenames={journal.SNAPSHOT_NAME,journal.JOURNAL_NAME,checkpoint.CHECKPOINT_NAME}
     for id,media in album['mediaItems'].items():
         filenames.add(media['filename'])
-    for file in Path(album['path']).glob('*'):
-        if file.name not in filenames:
+    # old media ids to find their store entries
+    ids={}
+    if store is not None and old_album is not None:
+        ids={media['filename']:id for id,media in old_album['mediaItems'].items() if 'filename' in media}
+    for name in sorted(names):
+        file=Path(album['path'],name)
+        if name not in filenames:
+            names.discard(name)
+            # keep content used by other albums
+            if store is not None and not storage.release(store,file,ids.get(file.name),STORE_HASH):
+                file.unlink()
+                print(album['title'],file.name,'excessive file unlinked, it is used by other albums')
+                continue
             moved=None
             if trash is not None:
                 moved=common.move_file(str(file),str(trash/album['title']/file.name))
@@ -269,36 +592,61 @@ def DowloadAlbum(api,trash,album,old_album):
                 file.unlink()
                 print(album['title'],file.name,'excessive file removed')
     # try to rename media files to original filenames
-    changed=False
     for id,media in album['mediaItems'].items():
         filename=Path(album['path'],media['filename'])
-        if filename.exists():
+        if filename.name in names:
             filename=common.move_file(str(filename),NameClear(str(filename),media['id']),False)
             if filename:
                 filename=Path(filename)
+                names.discard(media['filename'])
+                names.add(filename.name)
                 if media['filename']!=filename.name:
                     print(album['title'],filename.name,'renamed from',media['filename'])
                     media['filename']=filename.name
-                    changed=True
-    # and store it again
-    if changed:
-        with (Path(album['path'])/'album.json').open("w") as file:
-            json.dump(album,file,indent=2)
+                    if db is not None:
+                        catalog.store_media(db,album['id'],media)
+                    if journal_file is not None:
+                        journal.append(journal_file,media)
+    # store album metadata once all files are in place
+    StoreAlbum(album,db,journal_file)
     # ok
     print(album['title'],"is up to date now")
     return True
 
+# store album metadata
+def StoreAlbum(album,db=None,journal_file=None):
+    # media items are stored to catalog one by one, drop only removed ones
+    if db is not None:
+        catalog.store_album(db,album)
+        catalog.remove_media(db,album['id'],album['mediaItems'])
+        return
+    # compact journal to album.json snapshot
+    journal.compact(album['path'],album,journal_file)
+
+# album directory snapshot, set of file names
+def ScanAlbum(path):
+    with os.scandir(path) as entries:
+        return {entry.name for entry in entries}
+
 # check existing media
-def CheckMedia(trash,album,media,old):
+def CheckMedia(trash,album,media,old,store=None,names=None):
     # fake
     if old is None or 'filename' not in old:
         return False
+    if names is None:
+        names=ScanAlbum(album['path'])
     # check if exists
     oldpath=Path(album['path'],old['filename'])
-    if not oldpath.exists():
+    if oldpath.name not in names:
         return False
     # something changed
     if not common.compare_dict(media,old,{'baseUrl','filename'}):
+        names.discard(oldpath.name)
+        # keep content used by other albums
+        if store is not None and not storage.release(store,oldpath,old['id'],STORE_HASH):
+            oldpath.unlink()
+            print(album['title'],oldpath.name,'outdated file unlinked, it is used by other albums')
+            return False
         # move outdated file to trash directory
         moved=None
         if trash is not None:
@@ -317,60 +665,284 @@ def CheckMedia(trash,album,media,old):
     # ok
     return True
 
+# media download attempts
+DOWNLOAD_ATTEMPTS=7
+
 # dowload new media
-def DowloadMedia(api,trash,album,media):
+def DowloadMedia(api,trash,album,media,lock=None,busy=None,db=None,store=None,names=None,journal_file=None,urls=None):
     # can we store it?
     if 'filename' not in media:
+        ForgetUrl(urls,media)
         return True
-    # format destination
-    dest=Path(album['path'],media['filename'])
-    if dest.exists():
-        dest=Path(NameExtend(str(dest),media['id']))
-        if dest.exists():
-            # move outdated file to trash directory
-            moved=None
-            if trash is not None:
-                moved=common.move_file(str(dest),str(trash/album['title']/media['filename']))
-            if moved:
-                print(album['title'],dest.name,'outdated file moved to trash directory')
+    # queued download is left for the next run
+    if STOP.is_set():
+        ForgetUrl(urls,media)
+        return False
+    if lock is None:
+        lock=nullcontext()
+    if busy is None:
+        busy=set()
+    if names is None:
+        names=ScanAlbum(album['path'])
+    with lock:
+        # format destination
+        dest=Path(album['path'],media['filename'])
+        if dest.name in names or dest.name in busy:
+            dest=Path(NameExtend(str(dest),media['id']))
+            if dest.name in names:
+                names.discard(dest.name)
+                # keep content used by other albums
+                if store is not None and not storage.release(store,dest,media['id'],STORE_HASH):
+                    dest.unlink()
+                    print(album['title'],dest.name,'outdated file unlinked, it is used by other albums')
+                else:
+                    # move outdated file to trash directory
+                    moved=None
+                    if trash is not None:
+                        moved=common.move_file(str(dest),str(trash/album['title']/media['filename']))
+                    if moved:
+                        print(album['title'],dest.name,'outdated file moved to trash directory')
+                    else:
+                        dest.unlink()
+                        print(album['title'],dest.name,'outdated file deleted')
+        # reserve destination name until download is finished
+        reserved=dest.name
+        busy.add(reserved)
+        # format temp filename
+        tmp=dest.parent/(dest.name+'.tmp')
+        # file already exists, continue its download
+        if tmp.name in names:
+            print(album['title'],tmp.name,'resuming old temp file')
+    try:
+        # link already stored media instead of downloading it
+        stored=storage.lookup(store,media) if store is not None else None
+        if stored is not None:
+            common.link_file(str(stored),str(tmp))
+            with lock:
+                names.add(tmp.name)
+        # download media
+        else:
+            start=time.perf_counter()
+            refreshed=False
+            for attempt in range(DOWNLOAD_ATTEMPTS):
+                # baseUrl expires some time after media listing
+                if urls is not None and not RefreshUrls(api,urls,media):
+                    print(album['title'],tmp.name,'failed to refresh media URL, trying the old one')
+                status=FetchMedia(api,media['baseUrl']+'=d',tmp)
+                if status is True:
+                    break
+                code,reason=status
+                # access denied by expired baseUrl, refresh it once
+                if code==403 and urls is not None and not refreshed:
+                    refreshed=True
+                    RefreshUrls(api,urls,media,True)
+                    continue
+                # HTTP errors are already retried by API scheduler
+                if code is not None:
+                    print(album['title'],tmp.name,'download failed','[{status}]'.format(status=reason))
+                    return False
+                if attempt+1>=DOWNLOAD_ATTEMPTS:
+                    print(album['title'],tmp.name,'download failed, max attempts exceeded','[{status}]'.format(status=reason))
+                    return False
+                delay=ratelimit.backoff(attempt)
+                print(album['title'],tmp.name,'download failed, try again in',round(delay,1),'seconds','[{status}]'.format(status=reason))
+                # temp file is resumed by the next run
+                if STOP.wait(delay):
+                    return False
+            metrics.observe('download_seconds',time.perf_counter()-start)
+        with lock:
+            # rename
+            filename=common.move_file(str(tmp),str(dest))
+            names.discard(tmp.name)
+            # downloaded temp file metadata is not needed any more
+            TempMetaPath(tmp).unlink(missing_ok=True)
+            names.discard(TempMetaPath(tmp).name)
+            if filename:
+                dest=Path(filename)
+                names.add(dest.name)
             else:
-                dest.unlink()
-                print(album['title'],dest.name,'outdated file deleted')
-    # format temp filename
-    tmp=dest.parent/(dest.name+'.tmp')
-    # file already exists
-    if tmp.exists():
-        tmp.unlink()
-        print(album['title'],tmp.name,'removed old temp file')
-    # download media
-    for t in [1,2,5,15,30,60,0]:
-        resp = api.get(media['baseUrl']+'=d')
-        if resp.status_code is 200:
-            break
-        if t<=0:
-            print(album['title'],tmp.name,'download failed, max attempts exceeded','[{status} {reason}]'.format(status=resp.status_code,reason=resp.reason))
+                print(album['title'],dest.name,'failed to save file')
+                return False
+            # save media data to album
+            media['filename']=dest.name
+            album['mediaItems'][media['id']]=media
+            if db is not None:
+                catalog.store_media(db,album['id'],media,dest.stat().st_size,datetime.now(timezone.utc).timestamp()*1000)
+            if journal_file is not None:
+                journal.append(journal_file,media)
+            # share downloaded media with other albums
+            if store is not None and stored is None:
+                storage.add(store,media,dest,STORE_HASH)
+    finally:
+        with lock:
+            busy.discard(reserved)
+        ForgetUrl(urls,media)
+    print(album['title'],media['filename'],'linked from store' if stored is not None else 'downloaded')
+    metrics.count('downloads_total',result='linked' if stored is not None else 'downloaded')
+    return True
+
+# seconds after which media baseUrl expires and its refresh margin
+BASE_URL_TTL=60*60
+BASE_URL_MARGIN=10*60
+
+# maximum number of media items requested by mediaItems:batchGet
+BATCH_GET_SIZE=50
+
+# refreshes expired baseUrl of media together with expired baseUrls of other media waiting for download
+# returns False if refresh failed
+def RefreshUrls(api,urls,media,force=False):
+    with urls['lock']:
+        # baseUrl is being refreshed by another download, take its result
+        if media['id'] in urls['refreshing']:
+            while media['id'] in urls['refreshing']:
+                urls['refreshed'].wait()
+            return True
+        now=time.monotonic()
+        # fetch time is not known for media listed without page marks
+        def expired(id):
+            fetched=urls['fetched'].get(id)
+            return fetched is not None and now-fetched>=BASE_URL_TTL-BASE_URL_MARGIN
+        if not force and not expired(media['id']):
+            return True
+        # expired media refreshed by other downloads are left to them
+        refreshing=urls['refreshing']
+        ids=[media['id']]+[id for id in urls['media'] if id!=media['id'] and id not in refreshing and expired(id)][:BATCH_GET_SIZE-1]
+        refreshing.update(ids)
+    # lock is not held during request, other downloads register and forget their URLs meanwhile
+    results=None
+    try:
+        resp=api.get(API_URL+'/v1/mediaItems:batchGet?'+urlencode([('mediaItemIds',id) for id in ids]))
+        if resp.status_code==200:
+            results=json.loads(resp.content).get('mediaItemResults',[])
+        else:
+            print('media URLs refresh failed','[{status} {reason}]'.format(status=resp.status_code,reason=resp.reason))
+    except Exception as error:
+        print('media URLs refresh failed','[{0}]'.format(error))
+    with urls['lock']:
+        refreshing.difference_update(ids)
+        urls['refreshed'].notify_all()
+        if results is None:
             return False
-        print(album['title'],tmp.name,'download failed, try again in',t,'seconds','[{status} {reason}]'.format(status=resp.status_code,reason=resp.reason))
-        time.sleep(t)
-    # save media
-    with tmp.open('wb') as f:
-        f.write(resp.content)
-    if not tmp.exists():
-        print(album['title'],tmp.name,'failed to save file')
-        return False
-    # rename
-    filename=common.move_file(str(tmp),str(dest))
-    if filename:
-        dest=Path(filename)
-    else:
-        print(album['title'],dest.name,'failed to save file')
-        return False
-    # save media data to album
-    media['filename']=dest.name
-    album['mediaItems'][media['id']]=media
-    print(album['title'],media['filename'],'downloaded')
+        for result in results:
+            item=result.get('mediaItem')
+            if item is None or 'baseUrl' not in item:
+                continue
+            if item['id']==media['id']:
+                media['baseUrl']=item['baseUrl']
+            if item['id'] in urls['media']:
+                urls['media'][item['id']]['baseUrl']=item['baseUrl']
+                urls['fetched'][item['id']]=now
+    metrics.count('base_url_refresh_total',len(ids))
     return True
 
+# forgets baseUrl of media which is no longer waiting for download
+def ForgetUrl(urls,media):
+    if urls is None:
+        return
+    with urls['lock']:
+        urls['media'].pop(media['id'],None)
+        urls['fetched'].pop(media['id'],None)
+
+# streams url content to temp file resuming its previous part
+# returns True on success or failure HTTP status (None if not known) and description
+def FetchMedia(api,url,tmp,chunk_size=1<<20):
+    # continue from the end of existing temp file if it is known what it was downloaded from
+    meta=TempMetaPath(tmp)
+    try:
+        offset=tmp.stat().st_size
+    except FileNotFoundError:
+        offset=0
+    old=LoadTempMeta(meta) if offset>0 else None
+    headers={}
+    if old is not None:
+        headers['Range']='bytes={0}-'.format(offset)
+        # server sends whole content instead of range if media changed
+        etag=old.get('etag')
+        validator=etag if etag and not etag.startswith('W/') else old.get('last_modified')
+        if validator:
+            headers['If-Range']=validator
+    written=0
+    try:
+        with api.get(url,headers=headers,stream=True) as resp:
+            # temp file is complete or invalid, start again
+            if resp.status_code==416:
+                DropTemp(tmp)
+                return None,'{status} {reason}, restarting'.format(status=resp.status_code,reason=resp.reason)
+            # partial content, append to temp file
+            if resp.status_code==206:
+                # Content-Range: bytes <first>-<last>/<total>
+                crange=resp.headers.get('Content-Range','')
+                first,_,total=crange.partition(' ')[2].partition('/')
+                length=int(total) if total.isdigit() else None
+                if first.partition('-')[0]!=str(offset) or old is None or length!=old['total']:
+                    DropTemp(tmp)
+                    return None,'unexpected range '+crange+', restarting'
+                # content of temp file was replaced
+                if old.get('etag') and resp.headers.get('ETag',old['etag'])!=old['etag']:
+                    DropTemp(tmp)
+                    return None,'media changed, restarting'
+                mode='ab'
+            # full content, rewrite temp file
+            elif resp.status_code==200:
+                offset=0
+                length=resp.headers.get('Content-Length')
+                length=int(length) if length and length.isdigit() else None
+                mode='wb'
+            else:
+                return resp.status_code,'{status} {reason}'.format(status=resp.status_code,reason=resp.reason)
+            # encoded content length does not match decoded one
+            if resp.headers.get('Content-Encoding','identity')!='identity':
+                length=None
+            # temp file can be resumed only with content of the same size and validators
+            if mode=='wb':
+                meta.unlink(missing_ok=True)
+                if length is not None:
+                    StoreTempMeta(meta,{'total':length,'etag':resp.headers.get('ETag'),'last_modified':resp.headers.get('Last-Modified')})
+            # save media by chunks
+            with tmp.open(mode) as f:
+                for chunk in resp.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    written+=len(chunk)
+                    BACKLOG.transferred(len(chunk))
+                    if BANDWIDTH is not None:
+                        BANDWIDTH.consume(len(chunk))
+    except Exception as error:
+        return None,str(error)
+    finally:
+        metrics.count('download_bytes_total',written)
+    # check downloaded length
+    try:
+        size=tmp.stat().st_size
+    except FileNotFoundError:
+        size=0
+    if length is not None and size!=length:
+        return None,'incomplete file {0} of {1} bytes'.format(size,length)
+    return True
+
+# file keeping size and validators of content downloaded to temp file
+def TempMetaPath(tmp):
+    return tmp.parent/(tmp.name+'.meta')
+
+# loads temp file metadata, None if it is missing or invalid
+def LoadTempMeta(meta):
+    try:
+        with meta.open() as file:
+            data=json.load(file)
+        int(data['total'])
+        return data
+    except:
+        return None
+
+# stores temp file metadata
+def StoreTempMeta(meta,data):
+    with meta.open('w') as file:
+        json.dump(data,file)
+
+# removes temp file which can not be resumed with its metadata
+def DropTemp(tmp):
+    tmp.unlink(missing_ok=True)
+    TempMetaPath(tmp).unlink(missing_ok=True)
+
 # extend filename with id <original name>_<id last 8 chars>.<original extension>
 def NameExtend(name,id):
     path=Path(name)
@@ -384,14 +956,123 @@ def NameClear(name,id):
         return str(Path(path.parent)/(path.stem[:-9]+path.suffix))
     return name
 
+# synchronizes albums every interval keeping authorized session, albums and ignore list loaded
+# albums which changed recently are checked by every synchronization, dormant ones when their data change or revalidate days pass
+def RunDaemon(api,args,db=None):
+    dest=Path(args.destination)
+    trash=Path(args.trashbin) if args.trashbin else None
+    store=Path(args.store) if args.store else None
+    with metrics.phase('load'):
+        old_albums=LoadAlbums(dest,db)
+        ignore_albums=set(LoadIgnore(dest))
+        repair_albums=LoadRepair(args.repair)
+    # last time albums were seen changing
+    changed={}
+    trigger=threading.Event()
+    state={'state':'starting','pid':os.getpid(),'cycle':0,'album':None,'albums_done':0,'albums_total':0,'hot_albums':0,
+           'last_start':None,'last_end':None,'last_changed':None,'next_sync':None}
+    server=None
+    if args.status_port is not None:
+        # http.server takes long to import, import it only when status endpoint is used
+        import monitor
+        server=monitor.start(state,trigger,args.status_port,BACKLOG.report)
+        print('status endpoint at',server.url+'/status')
+    # first signal stops after downloads in progress, the second one exits right away
+    def Stop(signum,frame):
+        if STOP.is_set():
+            print('terminated, temp files are resumed by the next run')
+            os._exit(1)
+        print('stopping after downloads in progress')
+        STOP.set()
+        trigger.set()
+    handlers={sig:signal.signal(sig,Stop) for sig in (signal.SIGINT,signal.SIGTERM)}
+    try:
+        while not STOP.is_set():
+            trigger.clear()
+            now=time.time()
+            hot={id for id,stamp in changed.items() if now-stamp<args.hot_days*86400}
+            state.update({'state':'syncing','cycle':state['cycle']+1,'last_start':now,'next_sync':None,'hot_albums':len(hot)})
+            with metrics.phase('sync'):
+                res=DowloadAlbums(api,trash,dest,old_albums,ignore_albums,args.skip_new,args.jobs,db,store,
+                                  args.full,args.revalidate,args.page_size,args.resume,repair_albums,hot,state)
+                common.sync_files()
+                StoreRepair(args.repair,repair_albums)
+            for id in res or []:
+                changed[id]=time.time()
+            state.update({'state':'idle','last_end':time.time(),'last_changed':len(res) if res is not None else None,
+                          'next_sync':time.time()+args.interval*60})
+            if res:
+                print('changed albums:',len(res))
+            if args.metrics:
+                metrics.write_json(args.metrics)
+            if args.prometheus:
+                metrics.write_prometheus(args.prometheus)
+            # wait for the next synchronization or its trigger
+            if not STOP.is_set():
+                trigger.wait(args.interval*60)
+    finally:
+        state['state']='stopped'
+        for sig,handler in handlers.items():
+            signal.signal(sig,handler)
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
 # main flow
-api=Authorize(args)
-if api is None:
-    print('Google Photo API authorization failed')
-else:
-    old_albums=LoadAlbums(Path(args.destination))
-    ignore_albums=LoadIgnore(Path(args.destination))
-    DowloadAlbums(api,
-                  Path(args.trashbin) if args.trashbin else None,
-                  Path(args.destination),
-                  old_albums,ignore_albums,args.skip_new)
+def main(argv=None):
+    global API_URL,STORE_HASH,BANDWIDTH,BACKLOG
+    args = parser.parse_args(argv)
+    API_URL=args.api_url.rstrip('/')
+    STORE_HASH=args.store_hash
+    BANDWIDTH=transfer.Bandwidth(args.bandwidth) if args.bandwidth else None
+    BACKLOG=transfer.Backlog(BANDWIDTH)
+    if args.metrics or args.prometheus:
+        metrics.enable()
+    common.set_durability(args.durability)
+    # store entries are hard links of album files
+    if args.store and storage.device(args.store)!=storage.device(args.destination):
+        print('store',args.store,'is not on the same filesystem as destination',args.destination)
+        return 1
+    with metrics.phase('authorize'):
+        api=Authorize(args)
+    if api is None:
+        print('Google Photo API authorization failed')
+        code=1
+    else:
+        code=0
+        # all API requests share rate limit and backoff
+        api=ratelimit.Scheduler(api,args.rate,concurrency=args.jobs)
+        db=None
+        if args.catalog:
+            Path(args.destination).mkdir(parents=True,exist_ok=True)
+            db=catalog.open_catalog(Path(args.destination)/catalog.CATALOG_NAME)
+        if args.daemon:
+            # status endpoint reports run metrics
+            metrics.enable()
+            RunDaemon(api,args,db)
+        else:
+            with metrics.phase('load'):
+                old_albums=LoadAlbums(Path(args.destination),db)
+                ignore_albums=LoadIgnore(Path(args.destination))
+                repair_albums=LoadRepair(args.repair)
+            with metrics.phase('sync'):
+                DowloadAlbums(api,
+                              Path(args.trashbin) if args.trashbin else None,
+                              Path(args.destination),
+                              old_albums,ignore_albums,args.skip_new,args.jobs,db,
+                              Path(args.store) if args.store else None,
+                              args.full,args.revalidate,args.page_size,args.resume,repair_albums)
+                common.sync_files()
+                StoreRepair(args.repair,repair_albums)
+        if db is not None and args.export_json:
+            with metrics.phase('export'):
+                print('albums exported to album.json files:',catalog.export_json(db))
+    # run report
+    if args.metrics:
+        metrics.write_json(args.metrics)
+    if args.prometheus:
+        metrics.write_prometheus(args.prometheus)
+    return code
+
+if __name__=='__main__':
+    sys.exit(main())
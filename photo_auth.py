@@ -1,9 +1,6 @@
 import argparse
 import json
 import os
-import http.server
-import socketserver
-from requests_oauthlib import OAuth2Session
 
 # based on example https://requests-oauthlib.readthedocs.io/en/latest/examples/google.html
 
@@ -27,7 +24,6 @@ parser.add_argument('--redirect_proto', choices=['http', 'https'], default="http
 parser.add_argument("--redirect_host", default="localhost", help="Host to handle Google API athorization redirect")
 parser.add_argument("--redirect_port", choices=range(1,65535), metavar="[1-65535]", default=8080, help="Port to handle Google API athorization redirect")
 parser.add_argument("tokens_file", nargs='?', default=None, help="Destination json file to store obtained tokens")
-args = parser.parse_args()
 
 # loads authorization data 
 def LoadKeys(keys_file: str):
@@ -61,41 +57,60 @@ def HttpHandle(self):
 def HttpLogSilent(self, format, *args):
     pass
 
-# auth credentials
-if args.client_id:
-    client_id=args.client_id
-if args.client_secret:
-    client_secret=args.client_secret
-if args.keys_file and os.path.exists(args.keys_file):
-    LoadKeys(args.keys_file)
-# build redirect url
-redirect_url=args.redirect_proto+'://'+args.redirect_host+':'+str(args.redirect_port)
-
-# Redirect user to Google for authorization
-google = OAuth2Session(client_id, scope=scopes, redirect_uri=redirect_url)
-user_auth_url, state = google.authorization_url(auth_url,access_type="offline",prompt="select_account")
-print('Please go here and authorize:')
-print(user_auth_url)
-
-# start listening for http redirection
-handler=http.server.SimpleHTTPRequestHandler
-handler.do_GET=HttpHandle
-handler.log_message=HttpLogSilent
-
-with socketserver.TCPServer(("", args.redirect_port), handler) as httpd:
-    httpd.handle_request()
-
-# Fetch the access token
-if args.redirect_proto=='http':
-    os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
-token=google.fetch_token(token_url,client_secret=client_secret,authorization_response=redirect_url)
-
-# print tokens
-print('Use this token for your headless app authorization:')
-print(json.dumps(token))
-
-#store tokens
-if args.tokens_file:
-    with open(args.tokens_file, mode='w') as f:
-        json.dump(token,f)
-    print('Saved to',args.tokens_file)
+# runs authorization flow and returns obtained tokens
+def Authorize(redirect_proto='http',redirect_host='localhost',redirect_port=8080):
+    global redirect_url
+    # requests_oauthlib takes long to import, import it only when it is used
+    import http.server
+    import socketserver
+    from requests_oauthlib import OAuth2Session
+
+    # build redirect url
+    redirect_url=redirect_proto+'://'+redirect_host+':'+str(redirect_port)
+
+    # Redirect user to Google for authorization
+    google = OAuth2Session(client_id, scope=scopes, redirect_uri=redirect_url)
+    user_auth_url, state = google.authorization_url(auth_url,access_type="offline",prompt="select_account")
+    print('Please go here and authorize:')
+    print(user_auth_url)
+
+    # start listening for http redirection
+    handler=http.server.SimpleHTTPRequestHandler
+    handler.do_GET=HttpHandle
+    handler.log_message=HttpLogSilent
+
+    with socketserver.TCPServer(("", redirect_port), handler) as httpd:
+        httpd.handle_request()
+
+    # Fetch the access token
+    if redirect_proto=='http':
+        os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+    return google.fetch_token(token_url,client_secret=client_secret,authorization_response=redirect_url)
+
+# main flow
+def main(argv=None):
+    global client_id,client_secret
+    args = parser.parse_args(argv)
+
+    # auth credentials
+    if args.client_id:
+        client_id=args.client_id
+    if args.client_secret:
+        client_secret=args.client_secret
+    if args.keys_file and os.path.exists(args.keys_file):
+        LoadKeys(args.keys_file)
+
+    token=Authorize(args.redirect_proto,args.redirect_host,args.redirect_port)
+
+    # print tokens
+    print('Use this token for your headless app authorization:')
+    print(json.dumps(token))
+
+    #store tokens
+    if args.tokens_file:
+        with open(args.tokens_file, mode='w') as f:
+            json.dump(token,f)
+        print('Saved to',args.tokens_file)
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,173 @@
+import os,sys
+import argparse
+import json
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import common
+import catalog
+import storage
+import ratelimit
+import metrics
+import workers
+import transfer
+import photo_albums
+
+# declare command line parameters
+parser = argparse.ArgumentParser(description="Downloads Google Photos albums of several accounts sharing download workers and connections",
+                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                 epilog='''Config is json file with settings of photo_albums.py for all accounts and list of account profiles
+with their own settings, e.g. {"keys_file": "keys.json", "profiles": [{"name": "alice", "tokens_file": "alice.json",
+"destination": "/photos/alice", "trashbin": "/trash/alice", "ignore": ["Screenshots"]}, ...]}''')
+parser.add_argument("config", help="Batch config json file location")
+parser.add_argument("--jobs", type=int, default=None, help="Number of parallel media downloads of all accounts, config jobs by default")
+parser.add_argument("--bandwidth", type=transfer.parse_limits, default=None, help="Download bandwidth limit of all accounts, config bandwidth by default, e.g. 09:00-18:00=2M,18:00-23:00=20M")
+parser.add_argument("--metrics", default=None, help="File to store json report of run metrics")
+parser.add_argument("--prometheus", default=None, help="Prometheus textfile collector file to store run metrics")
+
+# settings which are the same for all accounts
+GLOBAL_KEYS={'api_url','store_hash','durability','jobs','bandwidth'}
+
+# profile keys which are not photo_albums.py settings
+PROFILE_KEYS={'name','ignore'}
+
+# builds account profiles of config, returns global settings and profiles or None if config is invalid
+def load_config(path):
+    with open(path) as file:
+        config=json.load(file)
+    defaults={k:v for k,v in config.items() if k!='profiles'}
+    settings=photo_albums.parser.parse_args(['-'])
+    for k,v in defaults.items():
+        if k not in vars(settings):
+            print('unknown setting',k,'in',path)
+            return None
+        setattr(settings,k,v)
+    if settings.bandwidth is not None:
+        try:
+            settings.bandwidth=transfer.parse_limits(settings.bandwidth)
+        except ValueError as error:
+            print('invalid bandwidth',settings.bandwidth,'in',path,error)
+            return None
+    profiles=[]
+    names=set()
+    dests=set()
+    for i,profile in enumerate(config.get('profiles',[])):
+        if 'destination' not in profile:
+            print('profile',i,'has no destination')
+            return None
+        # accounts authorize without user unless profile asks for it
+        args=photo_albums.parser.parse_args(['--headless',profile['destination']])
+        for k in profile:
+            if k in GLOBAL_KEYS:
+                print('setting',k,'of profile',i,'is the same for all accounts, set it at the top of config')
+                return None
+            if k not in PROFILE_KEYS and k not in vars(args):
+                print('unknown setting',k,'of profile',i)
+                return None
+        for k,v in list(defaults.items())+list(profile.items()):
+            if k not in PROFILE_KEYS:
+                setattr(args,k,v)
+        name=profile.get('name') or Path(args.destination).name
+        dest=os.path.abspath(args.destination)
+        # album state of every account is kept apart
+        if name in names or dest in dests:
+            print('profile',name,'repeats name or destination of another one')
+            return None
+        # store entries are hard links of album files
+        if args.store and storage.device(args.store)!=storage.device(dest):
+            print('store',args.store,'of profile',name,'is not on the same filesystem as its destination')
+            return None
+        names.add(name)
+        dests.add(dest)
+        profiles.append({'name':name,'args':args,'ignore':list(profile.get('ignore',[]))})
+    return settings,profiles
+
+# connection pool shared by sessions of all accounts, requests carry their own account authorization
+def share_connections(apis,jobs):
+    import requests.adapters
+    adapter=requests.adapters.HTTPAdapter(pool_connections=8,pool_maxsize=jobs+2*len(apis))
+    for api in apis:
+        api.mount('https://',adapter)
+        api.mount('http://',adapter)
+
+# synchronizes albums of account, returns True if albums were listed
+def sync_profile(profile,api,pool,jobs):
+    args=profile['args']
+    dest=Path(args.destination)
+    print(profile['name'],'synchronizing to',dest)
+    db=None
+    if args.catalog:
+        dest.mkdir(parents=True,exist_ok=True)
+        db=catalog.open_catalog(dest/catalog.CATALOG_NAME)
+    old_albums=photo_albums.LoadAlbums(dest,db)
+    ignore_albums=photo_albums.LoadIgnore(dest)+profile['ignore']
+    repair_albums=photo_albums.LoadRepair(args.repair)
+    res=photo_albums.DowloadAlbums(api,
+                                   Path(args.trashbin) if args.trashbin else None,
+                                   dest,old_albums,ignore_albums,args.skip_new,jobs,db,
+                                   Path(args.store) if args.store else None,
+                                   args.full,args.revalidate,args.page_size,args.resume,repair_albums,
+                                   pool=pool.lane(profile['name']))
+    photo_albums.StoreRepair(args.repair,repair_albums)
+    if db is not None and args.export_json:
+        print(profile['name'],'albums exported to album.json files:',catalog.export_json(db))
+    print(profile['name'],'synchronized' if res is not None else 'failed to list albums')
+    return res is not None
+
+# main flow
+def main(argv=None):
+    args = parser.parse_args(argv)
+    config=load_config(args.config)
+    if config is None:
+        return 1
+    settings,profiles=config
+    jobs=args.jobs or settings.jobs
+    photo_albums.API_URL=settings.api_url.rstrip('/')
+    photo_albums.STORE_HASH=settings.store_hash
+    # one limit for downloads of all accounts
+    limits=args.bandwidth or settings.bandwidth
+    photo_albums.BANDWIDTH=transfer.Bandwidth(limits) if limits else None
+    photo_albums.BACKLOG=transfer.Backlog(photo_albums.BANDWIDTH)
+    if args.metrics or args.prometheus:
+        metrics.enable()
+    common.set_durability(settings.durability)
+    code=0
+    # accounts are authorized one by one, interactive authorization uses the same redirect port
+    apis={}
+    with metrics.phase('authorize'):
+        for profile in profiles:
+            api=photo_albums.Authorize(profile['args'])
+            if api is None:
+                print(profile['name'],'Google Photo API authorization failed')
+                code=1
+                continue
+            apis[profile['name']]=api
+    if apis:
+        share_connections(list(apis.values()),jobs)
+        pool=workers.FairPool(jobs)
+        try:
+            with metrics.phase('sync'):
+                # every account lists its albums on its own thread, downloads of all accounts share pool
+                with ThreadPoolExecutor(max_workers=len(apis)) as accounts:
+                    futures=[accounts.submit(sync_profile,profile,
+                                             ratelimit.Scheduler(apis[profile['name']],profile['args'].rate,concurrency=jobs),
+                                             pool,jobs)
+                             for profile in profiles if profile['name'] in apis]
+                    for future in futures:
+                        try:
+                            if not future.result():
+                                code=1
+                        except Exception as error:
+                            print('account synchronization failed',error)
+                            code=1
+                common.sync_files()
+        finally:
+            pool.shutdown()
+    # run report
+    if args.metrics:
+        metrics.write_json(args.metrics)
+    if args.prometheus:
+        metrics.write_prometheus(args.prometheus)
+    return code
+
+if __name__=='__main__':
+    sys.exit(main())
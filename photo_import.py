@@ -1,27 +1,53 @@
 import os,sys,stat
+import signal
 import argparse
 import filecmp
 import re
+import queue
+import threading
+import socket
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from PIL import Image
-from PIL.ExifTags import TAGS
+from time import perf_counter,sleep
+import metadata
+import filecache
+import common
+import metrics
+import watcher
+import lease
 
  # declare command line parameters
 parser = argparse.ArgumentParser(description="Imports files from source directory to year-based subdirectories of destination",
                                  formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument("src", help="Source directory")
 parser.add_argument("dest", help="Destination directory")
-args = parser.parse_args()
+parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Number of parallel metadata extraction processes")
+parser.add_argument('--dedup', action='store_true', help="Index destination content to skip files already stored anywhere in it")
+parser.add_argument("--cache", default=None, help="Import cache database location, "+filecache.CACHE_NAME+" in destination by default")
+parser.add_argument('--no_cache', action='store_true', help="Do not use import cache")
+parser.add_argument('--cache_clear', action='store_true', help="Invalidate all import cache entries and exit")
+parser.add_argument("--metrics", default=None, help="File to store json report of run metrics")
+parser.add_argument("--prometheus", default=None, help="Prometheus textfile collector file to store run metrics")
+parser.add_argument("--durability", choices=['none','file','batch'], default='none', help="Sync moved files: none leaves it to OS, file syncs every file, batch syncs groups of files at once")
+parser.add_argument('--watch', action='store_true', help="Keep running after import and import new files as they appear in source")
+parser.add_argument("--settle", type=float, default=2.0, help="Seconds without writes after which watched file is imported")
+parser.add_argument("--poll", type=float, default=0, help="Poll source every given seconds instead of using inotify, 0 to use inotify where available")
+parser.add_argument('--distributed', action='store_true', help="Share source tree with importers on other hosts, source directories are claimed with lease files")
+parser.add_argument("--lease_dir", default=None, help="Lease files directory on storage shared by all importers, "+lease.LEASE_DIR+" in destination by default")
+parser.add_argument("--lease_ttl", type=float, default=120, help="Seconds after which lease of importer which stopped renewing it is taken over")
+parser.add_argument('--cache_compact', action='store_true', help="Remove import cache entries of changed or missing files and exit")
 
 # get image creation time
-def creation_time(entry):
+def creation_time(path):
     time=None
     # get time from exif
     try:
         stime=None
         stz=None
         # https://exiftool.org/TagNames/EXIF.html
-        exif=Image.open(entry.path)._getexif()
+        # header readers are used first, PIL is the last resort
+        exif=metadata.read_tags(path) or {}
         # 0x9003 	DateTimeOriginal 	string 	ExifIFD 	(date/time when original image was taken)   
         if 0x9003 in exif:
             stime=exif[0x9003]
@@ -59,12 +85,12 @@ def creation_time(entry):
             time=datetime.strptime(stime+stz,'%Y:%m:%d %H:%M:%S%z')
     # get time from filename
     if not time:
-        matches=re.findall(r'_([0-9]{8}_[0-9]{6})', entry.name)
+        matches=re.findall(r'_([0-9]{8}_[0-9]{6})', os.path.basename(path))
         if len(matches)>0:
             time=datetime.strptime(matches[0],'%Y%m%d_%H%M%S')
     # get time from file attributes
     if not time:
-        stat=entry.stat()
+        stat=os.stat(path)
         time=datetime.utcfromtimestamp(min(stat.st_atime,stat.st_mtime,stat.st_ctime))
     # return what we have
     return time
@@ -76,13 +102,14 @@ def move_file(srcpath,dstpath,allow_suffix=True):
         return True
     # create directory
     os.makedirs(os.path.dirname(dstpath),exist_ok=True)
-    # move file if it does not exist
-    if not os.path.exists(dstpath):
-        os.replace(srcpath,dstpath)
+    # move file if it does not exist, other importers may create the same destination at the same time
+    if common.move_new(srcpath,dstpath):
+        metrics.count('move_file_total',outcome='moved')
         return True
     # the same file, delete source
-    if filecmp.cmp(srcpath,dstpath):
+    if filecmp.cmp(srcpath,dstpath,shallow=False):
         os.remove(srcpath)
+        metrics.count('move_file_total',outcome='duplicate')
         return True
     # check if directory
     dststat=os.stat(dstpath)
@@ -95,21 +122,69 @@ def move_file(srcpath,dstpath,allow_suffix=True):
             if move_file(srcpath,"{0}_copy{2}{1}".format(*(os.path.splitext(dstpath)),i),False):
                 return True
         print('can not move '+srcpath+' to '+dstpath)
+        metrics.count('move_file_total',outcome='failed')
     # la problema
     return False
 
+# get destintaion path based on year creation
+def dest_path(path,time,dst):
+    return os.path.normpath(dst+'/'+str(time.year)+'/'+os.path.basename(path))
+
+# moves file using destination index instead of probing destination paths
+def move_file_indexed(srcpath,dstpath,index):
+    # the same path
+    if srcpath==dstpath:
+        return True
+    # the same content is already in destination, delete source
+    if common.index_find(index,srcpath):
+        os.remove(srcpath)
+        metrics.count('move_file_total',outcome='duplicate')
+        return True
+    # create directory
+    os.makedirs(os.path.dirname(dstpath),exist_ok=True)
+    while True:
+        # files different, take the first free name
+        newdest=common.index_free_name(index,dstpath,16)
+        if newdest is None:
+            print('can not move '+srcpath+' to '+dstpath)
+            metrics.count('move_file_total',outcome='failed')
+            return False
+        # do not overwrite files which appeared after indexing
+        if not common.move_new(srcpath,newdest):
+            common.index_add(index,newdest)
+            continue
+        common.index_add(index,newdest)
+        metrics.count('move_file_total',outcome='moved')
+        return True
+
 # moves file with supported extension to per-year subdirectories of dst
-def process_file(entry,dst):
-    if not entry.is_file():
+def process_file(entry,dst,cache=None,index=None):
+    # sources of cross-device moves waiting for sync are skipped
+    if not entry.is_file() or common.is_pending(entry.name):
         return
-    # get destintaion path based on year creation
-    time=creation_time(entry)
-    dstpath=os.path.normpath(dst+'/'+str(time.year)+'/'+entry.name)
+    import_file(entry.path,dst,cache,index,entry.stat() if cache is not None else None)
+
+# moves file to per-year subdirectory of dst
+def import_file(path,dst,cache=None,index=None,st=None):
+    # cached creation time of unchanged file
+    time=None
+    if cache is not None:
+        st=st or os.stat(path)
+        time=filecache.get_time(cache,st)
+        metrics.count('import_cache_total',result='miss' if time is None else 'hit')
+    if time is None:
+        with metrics.timer('metadata_seconds'):
+            time=creation_time(path)
+        if cache is not None:
+            filecache.put_time(cache,st,path,time,dest_path(path,time,dst))
     # move file
-    move_file(entry.path,dstpath)
+    if index is not None:
+        move_file_indexed(path,dest_path(path,time,dst),index)
+    else:
+        move_file(path,dest_path(path,time,dst))
 
 # moves all files with supported extensions from src to per-year subdirectories of dst
-def process_dir(src, dst, depth=16):
+def process_dir(src, dst, depth=16, cache=None, index=None):
     # cut recursion
     if depth==0:
       return
@@ -117,8 +192,277 @@ def process_dir(src, dst, depth=16):
     with os.scandir(src) as entries:
         for entry in entries:
             if entry.is_dir():
-                process_dir(entry.path,dst,depth-1);
+                process_dir(entry.path,dst,depth-1,cache,index);
+            else:
+                process_file(entry,dst,cache,index)
+
+# yields files of src in the same order as process_dir handles them
+def walk_dir(src, depth=16):
+    # cut recursion
+    if depth==0:
+      return
+    with os.scandir(src) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                yield from walk_dir(entry.path,depth-1)
+            elif entry.is_file() and not common.is_pending(entry.name):
+                yield entry.path
+
+# yields walked files by batches
+def batch_paths(paths, size):
+    batch=[]
+    for path in paths:
+        batch.append(path)
+        if len(batch)>=size:
+            yield batch
+            batch=[]
+    if batch:
+        yield batch
+
+# get creation time of file, None if it is gone, e.g. moved by another importer
+def creation_time_or_none(path):
+    try:
+        return creation_time(path)
+    except FileNotFoundError:
+        return None
+
+# get creation times of files batch, with extraction durations if timed
+def creation_times(paths, timed=False):
+    if not timed:
+        return [creation_time_or_none(path) for path in paths]
+    times=[]
+    durations=[]
+    for path in paths:
+        start=perf_counter()
+        times.append(creation_time_or_none(path))
+        durations.append(perf_counter()-start)
+    return times,durations
+
+# get file status, None if it is gone
+def stat_or_none(path):
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+# moves files from queue until None is received
+def move_files(moves, dst, index=None):
+    while True:
+        item=moves.get()
+        if item is None:
+            return
+        path,time=item
+        try:
+            if time is None:
+                raise FileNotFoundError(path)
+            if index is not None:
+                move_file_indexed(path,dest_path(path,time,dst),index)
             else:
-                process_file(entry,dst)
+                move_file(path,dest_path(path,time,dst))
+        except FileNotFoundError:
+            print(path,'is gone, skipped')
+            metrics.count('move_file_total',outcome='gone')
+
+# imports files appearing in src once they are completely written
+def watch_dir(src,dst,settle=2.0,poll=0,cache=None,index=None):
+    print('watching',src,'for new files')
+    for paths in watcher.watch(src,settle,poll or 5.0,skip=dst,poll=poll>0):
+        with metrics.phase('watch'):
+            for path in paths:
+                # sources of cross-device moves waiting for sync
+                if common.is_pending(os.path.basename(path)):
+                    continue
+                try:
+                    import_file(path,dst,cache,index)
+                except FileNotFoundError:
+                    continue
+                metrics.count('watch_files_total')
+            common.sync_files()
+            if cache is not None:
+                cache.commit()
+        print('imported',len(paths),'new files')
+
+# imports src files using pipeline: directory walker -> creation time extraction processes -> mover
+# files are moved in walk order so results are the same as of process_dir
+# files replace walk of src if given
+def process_dir_parallel(src, dst, jobs, batch=64, cache=None, index=None, files=None):
+    moves=queue.Queue(maxsize=jobs*batch*4)
+    # error which stopped mover, it is raised once mover is joined
+    failed=[]
+    def move():
+        try:
+            move_files(moves,dst,index)
+        except BaseException as error:
+            failed.append(error)
+    mover=threading.Thread(target=move)
+    mover.start()
+    # queues item for mover, returns False if mover is dead and nobody takes it
+    def put(item):
+        while mover.is_alive():
+            try:
+                moves.put(item,timeout=1.0)
+                return True
+            except queue.Full:
+                pass
+        return False
+    # passes batch times to mover in walk order
+    def complete(paths,stats,times,future):
+        if future is not None:
+            extracted=future.result()
+            # worker processes measure extraction themselves
+            if metrics.enabled:
+                extracted,durations=extracted
+                for duration in durations:
+                    metrics.observe('metadata_seconds',duration)
+            extracted=iter(extracted)
+            for i,time in enumerate(times):
+                if time is None:
+                    times[i]=next(extracted)
+                    if cache is not None and times[i] is not None and stats[i] is not None:
+                        filecache.put_time(cache,stats[i],paths[i],times[i],dest_path(paths[i],times[i],dst))
+        for item in zip(paths,times):
+            if not put(item):
+                raise RuntimeError('file mover stopped')
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            pending=deque()
+            for paths in batch_paths(walk_dir(src) if files is None else files,batch):
+                # take creation times of unchanged files from cache
+                stats=[None]*len(paths)
+                times=[None]*len(paths)
+                if cache is not None:
+                    stats=[stat_or_none(path) for path in paths]
+                    times=[filecache.get_time(cache,st) if st is not None else None for st in stats]
+                    metrics.count('import_cache_total',len(paths)-times.count(None),result='hit')
+                    metrics.count('import_cache_total',times.count(None),result='miss')
+                missing=[path for path,time in zip(paths,times) if time is None]
+                future=pool.submit(creation_times,missing,metrics.enabled) if missing else None
+                pending.append((paths,stats,times,future))
+                # keep limited number of batches in flight
+                while len(pending)>=jobs*2:
+                    complete(*pending.popleft())
+            while pending:
+                complete(*pending.popleft())
+    finally:
+        put(None)
+        mover.join()
+        if failed:
+            raise failed[0]
+
+# yields files of src directories claimed by this importer, directories held by other importers are added to skipped
+# directories are leased one by one, not with their subdirectories, so big subtrees are split between importers
+def claimed_files(src, leases, skipped, depth=16, root=None):
+    # cut recursion
+    if depth==0:
+        return
+    root=root or src
+    try:
+        with os.scandir(src) as entries:
+            entries=list(entries)
+    except FileNotFoundError:
+        return
+    dirs=[entry.path for entry in entries if entry.is_dir() and entry.path!=leases.path]
+    if any(entry.is_file() and not common.is_pending(entry.name) for entry in entries):
+        if leases.claim(os.path.relpath(src,root)):
+            # files are listed again once directory is claimed, another importer could move some meanwhile
+            try:
+                with os.scandir(src) as entries:
+                    files=[entry.path for entry in entries if entry.is_file() and not common.is_pending(entry.name)]
+            except FileNotFoundError:
+                files=[]
+            yield from files
+        else:
+            skipped.append(src)
+    for path in dirs:
+        yield from claimed_files(path,leases,skipped,depth-1,root)
+
+# imports files of src together with importers on other hosts sharing the tree
+# directories held by other importers are checked again until their leases are released or expire and are taken over
+# own leases are released before waiting for others so importers never wait for each other
+def process_shared(src, dst, jobs, leases, cache=None, index=None):
+    def run(files):
+        if jobs>1:
+            process_dir_parallel(src,dst,jobs,cache=cache,index=index,files=files)
+        else:
+            for path in files:
+                try:
+                    import_file(path,dst,cache,index)
+                except FileNotFoundError:
+                    print(path,'is gone, skipped')
+                    metrics.count('move_file_total',outcome='gone')
+        # files of claimed directories are in place
+        common.sync_files()
+        leases.release()
+    skipped=[]
+    run(claimed_files(src,leases,skipped))
+    while skipped:
+        print('directories held by other importers:',len(skipped))
+        sleep(leases.ttl/4)
+        held,skipped=skipped,[]
+        run(path for dirpath in held for path in claimed_files(dirpath,leases,skipped,1,src))
+
 # main flow
-process_dir(os.path.abspath(args.src),os.path.abspath(args.dest))
+def main(argv=None):
+    args = parser.parse_args(argv)
+    # cache maintenance must not fall through to import
+    if args.no_cache and (args.cache_clear or args.cache_compact):
+        parser.error('--cache_clear and --cache_compact can not be used with --no_cache')
+    if args.metrics or args.prometheus:
+        metrics.enable()
+    common.set_durability(args.durability)
+    cache=None
+    if not args.no_cache:
+        os.makedirs(os.path.abspath(args.dest),exist_ok=True)
+        name=filecache.CACHE_NAME
+        # importers on other hosts do not share cache database
+        if args.distributed:
+            name=name.replace('.db','.'+socket.gethostname()+'.db')
+        cache=filecache.open_cache(args.cache or os.path.join(os.path.abspath(args.dest),name))
+    # cache maintenance
+    if cache is not None and (args.cache_clear or args.cache_compact):
+        if args.cache_clear:
+            print('import cache entries removed:',filecache.clear(cache))
+        if args.cache_compact:
+            print('stale import cache entries removed:',filecache.compact(cache))
+        return
+    # destination content index is loaded once per run
+    index=None
+    if args.dedup:
+        with metrics.phase('index'):
+            # source inside destination is not indexed, its files would be found as their own duplicates
+            index=common.index_files(os.path.abspath(args.dest),skip=os.path.abspath(args.src))
+        print('destination files indexed:',len(index['files']))
+    leases=None
+    if args.distributed:
+        leases=lease.Leases(os.path.abspath(args.lease_dir or os.path.join(args.dest,lease.LEASE_DIR)),args.lease_ttl)
+    try:
+        with metrics.phase('import'):
+            if leases is not None:
+                # watching relies on exclusive destination writes only
+                process_shared(os.path.abspath(args.src),os.path.abspath(args.dest),args.jobs,leases,cache,index)
+                leases.close()
+            elif args.jobs>1:
+                process_dir_parallel(os.path.abspath(args.src),os.path.abspath(args.dest),args.jobs,cache=cache,index=index)
+            else:
+                process_dir(os.path.abspath(args.src),os.path.abspath(args.dest),cache=cache,index=index)
+        # import new files until interrupted
+        if args.watch:
+            signal.signal(signal.SIGTERM,signal.default_int_handler)
+            try:
+                watch_dir(os.path.abspath(args.src),os.path.abspath(args.dest),args.settle,args.poll,cache,index)
+            except KeyboardInterrupt:
+                print('watching stopped')
+    finally:
+        common.sync_files()
+        # leases are released once files of their directories are in place
+        if leases is not None:
+            leases.close()
+        if cache is not None:
+            cache.commit()
+        if args.metrics:
+            metrics.write_json(args.metrics)
+        if args.prometheus:
+            metrics.write_prometheus(args.prometheus)
+
+if __name__=='__main__':
+    main()
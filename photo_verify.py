@@ -0,0 +1,195 @@
+import os,sys
+import argparse
+import json
+import mmap
+import time
+import hashlib
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import catalog
+import journal
+import checkpoint
+import hashcache
+import metrics
+
+# default repair list file name under destination
+REPAIR_NAME='repair.json'
+
+# declare command line parameters
+parser = argparse.ArgumentParser(description="Verifies downloaded Google Photos albums against their stored metadata without using API",
+                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("destination", help="Albums download directory")
+parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Number of parallel hashing threads")
+parser.add_argument('--catalog', action='store_true', help="Albums metadata are kept in catalog database under destination")
+parser.add_argument('--full', action='store_true', help="Hash all files again to find content changed without size or mtime change")
+parser.add_argument("--cache", default=None, help="Hash cache database location, "+hashcache.CACHE_NAME+" in destination by default")
+parser.add_argument('--no_cache', action='store_true', help="Do not record hashes")
+parser.add_argument("--repair", default=None, help="Repair list file for photo_albums.py --repair, "+REPAIR_NAME+" in destination by default")
+parser.add_argument("--metrics", default=None, help="File to store json report of run metrics")
+parser.add_argument("--prometheus", default=None, help="Prometheus textfile collector file to store run metrics")
+
+# album directory files which are not media
+SERVICE_NAMES={journal.SNAPSHOT_NAME,journal.SNAPSHOT_TMP,journal.JOURNAL_NAME,checkpoint.CHECKPOINT_NAME}
+
+# sha256 of file content read through memory map, hashing releases GIL so threads hash in parallel
+def file_hash(path):
+    digest=hashlib.sha256()
+    with open(path,'rb') as file:
+        # empty files can not be mapped
+        if os.fstat(file.fileno()).st_size>0:
+            with mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ) as data:
+                with memoryview(data) as view:
+                    digest.update(view)
+    return digest.hexdigest()
+
+# loads albums with their media items, album.json files are read with their journals
+def load_albums(dest,db=None):
+    if db is not None:
+        albums=catalog.load_albums(db)
+        for id,album in albums.items():
+            album['mediaItems']=catalog.load_media(db,id)
+            album['sizes']=catalog.load_sizes(db,id)
+        return albums
+    albums={}
+    paths={path.parent for path in Path(dest).rglob(journal.SNAPSHOT_NAME)}
+    paths.update(path.parent for path in Path(dest).rglob(journal.JOURNAL_NAME))
+    for path in sorted(paths):
+        album=journal.replay(path)
+        if album is None or 'id' not in album:
+            print('failed to load album metadata in',path)
+            continue
+        album['path']=str(path.absolute())
+        album.setdefault('mediaItems',{})
+        albums[album['id']]=album
+    return albums
+
+# empty album issues: media ids missing, empty, of unexpected size or changed content and names of excess and temp files
+def new_issues(album):
+    return {'title':album.get('title'),'path':album['path'],
+            'missing':[],'empty':[],'truncated':[],'corrupt':[],'extra':[],'partial':[]}
+
+# reconciles album directory with album media items
+# returns album issues and media files to hash
+def check_album(album):
+    issues=new_issues(album)
+    files=[]
+    try:
+        with os.scandir(album['path']) as entries:
+            stats={entry.name:entry.stat() for entry in entries if entry.is_file(follow_symlinks=False)}
+    except FileNotFoundError:
+        stats={}
+    filenames=set()
+    sizes=album.get('sizes',{})
+    for id,media in album['mediaItems'].items():
+        if 'filename' not in media:
+            continue
+        filenames.add(media['filename'])
+        st=stats.get(media['filename'])
+        if st is None:
+            issues['missing'].append(id)
+        elif st.st_size==0:
+            issues['empty'].append(id)
+        elif id in sizes and sizes[id]!=st.st_size:
+            issues['truncated'].append(id)
+        else:
+            files.append((id,os.path.join(album['path'],media['filename']),st))
+    for name in sorted(stats):
+        if name in filenames or name in SERVICE_NAMES:
+            continue
+        # metadata of interrupted download belongs to its temp file
+        if name.endswith('.tmp.meta') and name[:-len('.meta')] in stats:
+            continue
+        # interrupted downloads
+        if name.endswith('.tmp') or name.endswith('.tmp.meta'):
+            issues['partial'].append(name)
+        else:
+            issues['extra'].append(name)
+    return issues,files
+
+# hashes files which changed since their last verification, all of them if full is set
+# returns ids of files with content changed without size or mtime change
+def hash_files(files,jobs,cache=None,full=False):
+    corrupt=[]
+    todo=[]
+    for album_id,id,path,st in files:
+        recorded=hashcache.get_hash(cache,path,st) if cache is not None else None
+        if recorded is not None and not full:
+            metrics.count('verify_files_total',result='cached')
+            continue
+        todo.append((album_id,id,path,st,recorded))
+    checked=time.time()
+    with ThreadPoolExecutor(max_workers=max(jobs,1)) as pool:
+        for (album_id,id,path,st,recorded),digest in zip(todo,pool.map(lambda item: hash_or_none(item[2]),todo)):
+            if digest is None:
+                continue
+            metrics.count('verify_files_total',result='hashed')
+            if recorded is not None and recorded!=digest:
+                corrupt.append((album_id,id,path))
+            if cache is not None:
+                hashcache.put_hash(cache,path,st,digest,checked)
+    return corrupt
+
+# file hash or None if file can not be read
+def hash_or_none(path):
+    try:
+        return file_hash(path)
+    except OSError as error:
+        print('failed to hash',path,error)
+        return None
+
+# verifies albums, returns repair list
+def verify(dest,jobs,db=None,cache=None,full=False):
+    albums=load_albums(dest,db)
+    print('local albums in',dest,':',len(albums))
+    repair={}
+    files=[]
+    for id,album in albums.items():
+        issues,album_files=check_album(album)
+        files+=[(id,)+item for item in album_files]
+        if any(v for v in issues.values() if isinstance(v,list)):
+            repair[id]=issues
+    for album_id,id,path in hash_files(files,jobs,cache,full):
+        print(albums[album_id].get('title'),os.path.basename(path),'content changed without size or mtime change')
+        repair.setdefault(album_id,new_issues(albums[album_id]))['corrupt'].append(id)
+    # media to download again
+    for item in repair.values():
+        item['media']=item['missing']+item['empty']+item['truncated']+item['corrupt']
+    return {'created':time.time(),'files':len(files),'albums':repair}
+
+# prints verification summary
+def print_report(report):
+    totals={}
+    for id,item in sorted(report['albums'].items(),key=lambda i: str(i[1]['title'])):
+        counts={k:len(v) for k,v in item.items() if isinstance(v,list) and v and k!='media'}
+        for k,v in counts.items():
+            totals[k]=totals.get(k,0)+v
+        print(item['title'],', '.join('{0} {1}'.format(v,k) for k,v in sorted(counts.items())))
+    print('files verified:',report['files'])
+    print('albums to repair:',len(report['albums']),' '.join('{0} {1}'.format(v,k) for k,v in sorted(totals.items())))
+
+# main flow
+def main(argv=None):
+    args = parser.parse_args(argv)
+    if args.metrics or args.prometheus:
+        metrics.enable()
+    dest=os.path.abspath(args.destination)
+    db=catalog.open_catalog(os.path.join(dest,catalog.CATALOG_NAME)) if args.catalog else None
+    cache=None
+    if not args.no_cache:
+        cache=hashcache.open_cache(args.cache or os.path.join(dest,hashcache.CACHE_NAME))
+    try:
+        with metrics.phase('verify'):
+            report=verify(dest,args.jobs,db,cache,args.full)
+        print_report(report)
+        metrics.write_file(args.repair or os.path.join(dest,REPAIR_NAME),json.dumps(report,indent=2))
+    finally:
+        if cache is not None:
+            cache.commit()
+        if args.metrics:
+            metrics.write_json(args.metrics)
+        if args.prometheus:
+            metrics.write_prometheus(args.prometheus)
+    return 1 if report['albums'] else 0
+
+if __name__=='__main__':
+    sys.exit(main())
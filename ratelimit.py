@@ -0,0 +1,146 @@
+import time
+import random
+import threading
+from urllib.parse import urlparse
+from datetime import datetime,timezone
+from email.utils import parsedate_to_datetime
+import metrics
+
+# statuses worth retrying, any other error status is fatal
+RETRYABLE={408,429,500,502,503,504}
+
+# exponential backoff delay with full jitter
+def backoff(attempt,base=1.0,cap=60.0):
+    return random.uniform(0,min(cap,base*(2**attempt)))
+
+# parses Retry-After header value, seconds or HTTP date
+def retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0,float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0,(parsedate_to_datetime(value)-datetime.now(timezone.utc)).total_seconds())
+    except (TypeError,ValueError):
+        return None
+
+# metrics endpoint label of request url, media downloads are not API endpoints
+def endpoint(url):
+    path=urlparse(url).path
+    return path if path.startswith('/v1/') else 'download'
+
+# request scheduler around API session
+# limits requests rate with token bucket, retries throttled and failed requests and
+# cuts number of concurrent requests down while API keeps throttling
+# media downloads are not API calls, they are retried the same way but not limited,
+# their number is bounded by download workers and their bytes by bandwidth limit
+class Scheduler:
+    def __init__(self,session,rate=10.0,burst=None,concurrency=8,attempts=7,verbose=True):
+        self.session=session
+        self.rate=rate
+        self.burst=burst or max(rate,1.0)
+        self.tokens=self.burst
+        self.stamp=time.monotonic()
+        self.max_concurrency=max(concurrency,1)
+        self.concurrency=self.max_concurrency
+        self.active=0
+        self.successes=0
+        self.throttled=0.0
+        self.paused=0.0
+        self.attempts=attempts
+        self.verbose=verbose
+        self.calls=0
+        self.cond=threading.Condition()
+
+    # other session attributes are used as is
+    def __getattr__(self,name):
+        return getattr(self.session,name)
+
+    # waits for request slot and rate token, requests which are not limited go at once
+    def acquire(self,limited=True):
+        if not limited:
+            return
+        with self.cond:
+            while True:
+                now=time.monotonic()
+                if self.rate>0:
+                    self.tokens=min(self.burst,self.tokens+(now-self.stamp)*self.rate)
+                self.stamp=now
+                wait=self.paused-now
+                if wait<=0 and self.active>=self.concurrency:
+                    wait=None
+                elif wait<=0 and self.rate>0 and self.tokens<1:
+                    wait=(1-self.tokens)/self.rate
+                elif wait<=0:
+                    self.tokens-=1
+                    self.active+=1
+                    self.calls+=1
+                    return
+                self.cond.wait(wait)
+
+    # releases request slot adapting concurrency to API responses
+    def release(self,throttled=False,delay=None,limited=True):
+        if not limited:
+            return
+        with self.cond:
+            self.active-=1
+            now=time.monotonic()
+            if throttled:
+                # pause all requests as asked by server
+                if delay:
+                    self.paused=max(self.paused,now+delay)
+                # multiplicative decrease, at most once a second
+                if now-self.throttled>1.0 and self.concurrency>1:
+                    self.concurrency=max(1,self.concurrency//2)
+                    if self.verbose:
+                        print('API throttling, concurrent requests limited to',self.concurrency)
+                self.throttled=now
+                self.successes=0
+            else:
+                # additive increase after a window of successful requests
+                self.successes+=1
+                if self.concurrency<self.max_concurrency and self.successes>=self.concurrency*4:
+                    self.concurrency+=1
+                    self.successes=0
+            self.cond.notify_all()
+
+    # sends request retrying throttled and temporary failed ones
+    def request(self,method,url,**kwargs):
+        api=endpoint(url)!='download'
+        name=endpoint(url) if metrics.enabled else None
+        for attempt in range(self.attempts):
+            self.acquire(api)
+            try:
+                with metrics.timer('api_request_seconds',endpoint=name):
+                    resp=self.session.request(method,url,**kwargs)
+            except OSError as error:
+                metrics.count('api_requests_total',endpoint=name,status='error')
+                self.release(limited=api)
+                if attempt+1>=self.attempts:
+                    raise
+                delay=backoff(attempt)
+                if self.verbose:
+                    print('request failed, try again in',round(delay,1),'seconds','[{0}]'.format(error))
+                time.sleep(delay)
+                continue
+            metrics.count('api_requests_total',endpoint=name,status=resp.status_code)
+            if resp.status_code not in RETRYABLE or attempt+1>=self.attempts:
+                self.release(limited=api)
+                return resp
+            # server delay or jittered backoff
+            delay=retry_after(resp.headers.get('Retry-After'))
+            self.release(resp.status_code==429 or delay is not None,delay,api)
+            if delay is None:
+                delay=backoff(attempt)
+            if self.verbose:
+                print('request failed, try again in',round(delay,1),'seconds','[{status} {reason}]'.format(status=resp.status_code,reason=resp.reason))
+            resp.close()
+            time.sleep(delay)
+
+    def get(self,url,**kwargs):
+        return self.request('GET',url,**kwargs)
+
+    def post(self,url,data=None,**kwargs):
+        return self.request('POST',url,data=data,**kwargs)
@@ -0,0 +1,118 @@
+import os
+import json
+import hashlib
+import filecmp
+import threading
+from pathlib import Path
+import common
+
+# store entries are shared between download threads
+lock=threading.Lock()
+
+# media fields which do not describe its content
+VOLATILE_KEYS={'baseUrl','filename'}
+
+# device of path or of its nearest existing parent, store and destination must share it to link files
+def device(path):
+    path=Path(path).absolute()
+    while not path.exists() and path.parent!=path:
+        path=path.parent
+    return path.stat().st_dev
+
+# store entry of media id
+def entry_path(store,id):
+    return Path(store,id[-2:],id)
+
+# store entry of content hash
+def hash_path(store,digest):
+    return Path(store,'sha256',digest[:2],digest)
+
+# calculates file content hash
+def file_hash(path,chunk_size=1<<20):
+    digest=hashlib.sha256()
+    with open(path,'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size),b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# media ids which were stored with content of hash entry
+def content_ids(content):
+    try:
+        with content.with_suffix('.json').open() as file:
+            return json.load(file)['ids']
+    except:
+        return []
+
+# records media id sharing content of hash entry
+def add_content_id(content,id):
+    ids=content_ids(content)
+    if id in ids:
+        return
+    tmp=content.with_suffix('.json.tmp')
+    with tmp.open('w') as file:
+        json.dump({'ids':ids+[id]},file)
+    os.replace(tmp,content.with_suffix('.json'))
+
+# finds up to date store entry of media
+def lookup(store,media):
+    entry=entry_path(store,media['id'])
+    try:
+        with entry.with_suffix('.json').open() as file:
+            stored=json.load(file)
+    except:
+        return None
+    if not entry.exists() or not common.compare_dict(media,stored,VOLATILE_KEYS):
+        return None
+    return entry
+
+# adds downloaded media file to store, returns path of stored content
+def add(store,media,path,use_hash=False):
+    entry=entry_path(store,media['id'])
+    with lock:
+        # share content of other media with the same hash
+        if use_hash:
+            content=hash_path(store,file_hash(path))
+            if content.exists() and not os.path.samefile(content,path) and filecmp.cmp(content,path,False):
+                common.link_file(str(content),str(path))
+            elif not content.exists():
+                common.link_file(str(path),str(content))
+            # content entry keeps ids of its media to tell store links from album ones on release
+            if os.path.samefile(content,path):
+                add_content_id(content,media['id'])
+        common.link_file(str(path),str(entry))
+        meta={k:v for k,v in media.items() if k not in VOLATILE_KEYS}
+        tmp=entry.with_suffix('.json.tmp')
+        with tmp.open('w') as file:
+            json.dump(meta,file)
+        os.replace(tmp,entry.with_suffix('.json'))
+    return entry
+
+# releases album link to media file before its removal
+# returns False if content is still used by other albums and the link can be simply unlinked
+def release(store,path,id=None,use_hash=False):
+    with lock:
+        st=os.stat(path)
+        if st.st_nlink<=1:
+            return True
+        # links of store itself do not count as references
+        entries=[]
+        if id:
+            entry=entry_path(store,id)
+            if entry.exists() and os.path.samestat(entry.stat(),st):
+                entries.append(entry)
+        # shared content is linked by hash entry and entries of all its media
+        if use_hash and st.st_nlink>len(entries)+1:
+            content=hash_path(store,file_hash(path))
+            if content.exists() and os.path.samestat(content.stat(),st):
+                entries.append(content)
+                for other in content_ids(content):
+                    entry=entry_path(store,other)
+                    if other!=id and entry.exists() and os.path.samestat(entry.stat(),st):
+                        entries.append(entry)
+        if st.st_nlink>len(entries)+1:
+            return False
+        # last album reference, drop store entries
+        for entry in entries:
+            entry.unlink()
+            entry.with_suffix('.json').unlink(missing_ok=True)
+        return True
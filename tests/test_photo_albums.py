@@ -0,0 +1,171 @@
+import os,sys
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+import requests
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fakephotos
+import checkpoint
+import photo_albums
+
+# photo_albums.py runs against local fake API
+class AlbumsTest(unittest.TestCase):
+    def setUp(self):
+        self.root=Path(tempfile.mkdtemp(prefix='test_albums_'))
+        self.library=fakephotos.make_library(2,10,0.3,1000)
+        self.server=fakephotos.start(self.library)
+        self.api=requests.Session()
+        self.api_url=photo_albums.API_URL
+        photo_albums.API_URL=self.server.url
+        self.fetch_media=photo_albums.FetchMedia
+
+    def tearDown(self):
+        photo_albums.API_URL=self.api_url
+        photo_albums.FetchMedia=self.fetch_media
+        photo_albums.STOP.clear()
+        self.api.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root,ignore_errors=True)
+
+    # download URL and content of media
+    def media(self,id):
+        size=self.library['media'][id]['size']
+        return self.server.url+'/media/'+id+'=d',fakephotos.media_content(id,size)
+
+    # temp file is resumed from its end when media did not change
+    def test_resume_same_media(self):
+        id=next(iter(self.library['media']))
+        url,content=self.media(id)
+        tmp=self.root/'a.jpg.tmp'
+        self.assertIs(photo_albums.FetchMedia(self.api,url,tmp),True)
+        with tmp.open('r+b') as file:
+            file.truncate(100)
+        self.server.take_counters()
+        self.assertIs(photo_albums.FetchMedia(self.api,url,tmp),True)
+        self.assertEqual(tmp.read_bytes(),content)
+        self.assertEqual(self.server.take_counters()['bytes'],len(content)-100)
+
+    # temp file of media which changed since it was started is downloaded again
+    def test_resume_changed_media(self):
+        id=next(iter(self.library['media']))
+        url,content=self.media(id)
+        tmp=self.root/'a.jpg.tmp'
+        self.assertIs(photo_albums.FetchMedia(self.api,url,tmp),True)
+        # partial content of old version differs from new one
+        tmp.write_bytes(b'x'*100)
+        self.library['media'][id]['size']+=1
+        url,content=self.media(id)
+        self.assertIs(photo_albums.FetchMedia(self.api,url,tmp),True)
+        self.assertEqual(tmp.read_bytes(),content)
+
+    # temp file without metadata is not trusted
+    def test_resume_without_meta(self):
+        id=next(iter(self.library['media']))
+        url,content=self.media(id)
+        tmp=self.root/'a.jpg.tmp'
+        tmp.write_bytes(b'x'*100)
+        self.assertIs(photo_albums.FetchMedia(self.api,url,tmp),True)
+        self.assertEqual(tmp.read_bytes(),content)
+
+    # synchronizes albums to destination
+    def sync(self,jobs=2,page_size=100):
+        dest=self.root/'photos'
+        return photo_albums.DowloadAlbums(self.api,self.root/'trash',dest,photo_albums.LoadAlbums(dest),[],False,jobs,page_size=page_size)
+
+    # media files of albums by album titles
+    def album_files(self):
+        return {album.name:sorted(path.name for path in album.iterdir() if path.suffix in ('.jpg','.mp4'))
+                for album in (self.root/'photos').iterdir() if album.is_dir()}
+
+    # cold synchronization stores media under their names and the next one downloads nothing
+    def test_sync(self):
+        self.assertIsNotNone(self.sync())
+        expected={album['title']:sorted(self.library['media'][id]['filename'] for id in self.library['items'][album['id']])
+                  for album in self.library['albums']}
+        self.assertEqual(self.album_files(),expected)
+        for album in self.library['albums']:
+            for id in self.library['items'][album['id']]:
+                path=self.root/'photos'/album['title']/self.library['media'][id]['filename']
+                self.assertEqual(path.read_bytes(),self.media(id)[1])
+        self.server.take_counters()
+        self.assertEqual(self.sync(),[])
+        self.assertNotIn('bytes',self.server.take_counters())
+        self.assertEqual(self.album_files(),expected)
+        self.assertFalse((self.root/'trash').exists())
+
+    # synchronization stopped partway keeps pages completed by its last downloads and the next one continues from them
+    def test_stop_and_resume(self):
+        self.library=self.server.library=fakephotos.make_library(1,450,0,100)
+        fetched=[]
+        # stop after 250 downloads
+        def fetch(api,url,tmp,*args):
+            fetched.append(url)
+            if len(fetched)==250:
+                photo_albums.STOP.set()
+            return self.fetch_media(api,url,tmp,*args)
+        photo_albums.FetchMedia=fetch
+        self.sync(page_size=50)
+        album=self.root/'photos'/'Album 0'
+        state=checkpoint.load(album)
+        self.assertIsNotNone(state)
+        self.assertGreaterEqual(int(state['pageToken']),200)
+        photo_albums.STOP.clear()
+        first=len(fetched)
+        self.server.take_counters()
+        self.assertIsNotNone(self.sync(page_size=50))
+        # pages before saved token are not listed again
+        self.assertLessEqual(self.server.take_counters()['search'],(450-int(state['pageToken']))//50+1)
+        self.assertEqual(len(fetched)-first,450-first)
+        self.assertEqual(len([path for path in album.iterdir() if path.suffix=='.jpg']),450)
+        self.assertIsNone(checkpoint.load(album))
+
+    # downloads register and forget their URLs while expired ones are refreshed
+    def test_refresh_urls_unlocked(self):
+        ids=list(self.library['media'])[:2]
+        media={id:{'id':id,'baseUrl':'old'} for id in ids}
+        urls={'lock':threading.Lock(),'media':dict(media),'fetched':{id:0 for id in ids},'refreshing':set()}
+        urls['refreshed']=threading.Condition(urls['lock'])
+        started=threading.Event()
+        forgotten=threading.Event()
+        # batchGet waits until other download forgets its URL
+        class Api:
+            def get(api,url,**kwargs):
+                started.set()
+                if not forgotten.wait(5):
+                    raise OSError('URLs are locked during request')
+                return self.api.get(url,**kwargs)
+        refresh=threading.Thread(target=lambda: self.assertTrue(photo_albums.RefreshUrls(Api(),urls,media[ids[0]])))
+        refresh.start()
+        started.wait(5)
+        photo_albums.ForgetUrl(urls,media[ids[1]])
+        forgotten.set()
+        refresh.join()
+        self.assertNotEqual(media[ids[0]]['baseUrl'],'old')
+        self.assertEqual(urls['media'],{ids[0]:media[ids[0]]})
+        self.assertEqual(urls['refreshing'],set())
+
+    # small media of the next album are not held back by large media of the previous one
+    def test_large_media_of_other_album(self):
+        video=self.library['items']['album000000'][0]
+        self.library['media'][video]=fakephotos.make_media(video,5000,'2020-01-01T00:00:00Z',True)
+        finished={}
+        # video download is slow
+        def fetch(api,url,tmp,*args):
+            if video in url:
+                time.sleep(2)
+            res=self.fetch_media(api,url,tmp,*args)
+            finished[url.rpartition('/')[2][:-2]]=time.monotonic()
+            return res
+        photo_albums.FetchMedia=fetch
+        self.assertIsNotNone(self.sync(jobs=2))
+        others=[id for id in self.library['items']['album000001'] if id!=video]
+        self.assertEqual(len(finished),len(self.library['media']))
+        self.assertLess(max(finished[id] for id in others),finished[video])
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os,sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import photo_import
+
+# photo_import.py runs against temporary source and destination trees
+class ImportTest(unittest.TestCase):
+    def setUp(self):
+        self.root=tempfile.mkdtemp(prefix='test_import_')
+
+    def tearDown(self):
+        shutil.rmtree(self.root,ignore_errors=True)
+
+    # creates file with content, returns its path
+    def make(self,path,data):
+        path=os.path.join(self.root,path)
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        with open(path,'wb') as file:
+            file.write(data)
+        return path
+
+    # all files under root with their contents
+    def files(self):
+        files={}
+        for dirpath,dirs,names in os.walk(self.root):
+            for name in names:
+                with open(os.path.join(dirpath,name),'rb') as file:
+                    files[os.path.relpath(os.path.join(dirpath,name),self.root)]=file.read()
+        return files
+
+    # deduplicated import of source inside destination keeps unique files
+    def test_dedup_source_inside_destination(self):
+        for jobs in ('1','2'):
+            with self.subTest(jobs=jobs):
+                self.make('lib/incoming/IMG_20200101_120000.jpg',b'unique '+jobs.encode())
+                photo_import.main(['--dedup','--no_cache','--jobs',jobs,
+                                   os.path.join(self.root,'lib','incoming'),os.path.join(self.root,'lib')])
+                self.assertIn(os.path.join('lib','2020','IMG_20200101_120000.jpg'),self.files())
+                shutil.rmtree(os.path.join(self.root,'lib'))
+
+    # deduplicated import still drops files already stored in destination
+    def test_dedup_drops_duplicate(self):
+        self.make('lib/2020/IMG_20200101_120000.jpg',b'same')
+        self.make('lib/incoming/IMG_20200101_120000.jpg',b'same')
+        photo_import.main(['--dedup','--no_cache','--jobs','1',
+                           os.path.join(self.root,'lib','incoming'),os.path.join(self.root,'lib')])
+        self.assertEqual(self.files(),{os.path.join('lib','2020','IMG_20200101_120000.jpg'):b'same'})
+
+    # sources of cross-device moves waiting for sync are not imported again
+    def test_pending_source_skipped(self):
+        for jobs in ('1','2'):
+            with self.subTest(jobs=jobs):
+                pending=self.make('src/.IMG_20200101_120000.jpg.moved',b'copied')
+                self.make('src/IMG_20210101_120000.jpg',b'new')
+                photo_import.main(['--no_cache','--durability','batch','--jobs',jobs,
+                                   os.path.join(self.root,'src'),os.path.join(self.root,'dst')])
+                self.assertEqual(self.files(),{os.path.relpath(pending,self.root):b'copied',
+                                               os.path.join('dst','2021','IMG_20210101_120000.jpg'):b'new'})
+                shutil.rmtree(self.root)
+
+    # cache maintenance without cache is rejected instead of running import
+    def test_cache_maintenance_without_cache(self):
+        path=self.make('src/IMG_20200101_120000.jpg',b'data')
+        for option in ('--cache_clear','--cache_compact'):
+            with self.subTest(option=option):
+                with self.assertRaises(SystemExit):
+                    photo_import.main(['--no_cache',option,os.path.join(self.root,'src'),os.path.join(self.root,'dst')])
+                self.assertEqual(self.files(),{os.path.relpath(path,self.root):b'data'})
+
+    # parallel import stops with error of file mover instead of waiting for it forever
+    def test_mover_error_raised(self):
+        for i in range(40):
+            self.make('src/IMG_20200101_1200{0:02d}.jpg'.format(i),b'data')
+        def move_file(srcpath,dstpath):
+            raise PermissionError(dstpath)
+        saved=photo_import.move_file
+        photo_import.move_file=move_file
+        try:
+            with self.assertRaises(PermissionError):
+                photo_import.process_dir_parallel(os.path.join(self.root,'src'),os.path.join(self.root,'dst'),2,batch=1)
+        finally:
+            photo_import.move_file=saved
+        self.assertEqual(len(os.listdir(os.path.join(self.root,'src'))),40)
+
+if __name__=='__main__':
+    unittest.main()
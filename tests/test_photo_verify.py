@@ -0,0 +1,36 @@
+import os,sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import photo_verify
+
+# album directory is checked against its media items
+class VerifyTest(unittest.TestCase):
+    def setUp(self):
+        self.root=tempfile.mkdtemp(prefix='test_verify_')
+
+    def tearDown(self):
+        shutil.rmtree(self.root,ignore_errors=True)
+
+    # creates album file with content
+    def make(self,name,data=b'data'):
+        with open(os.path.join(self.root,name),'wb') as file:
+            file.write(data)
+
+    # metadata of resumable download is part of partial download, not extra file
+    def test_partial_download_meta(self):
+        self.make('x.jpg')
+        self.make('y.jpg.tmp')
+        self.make('y.jpg.tmp.meta',b'{"total": 10}')
+        self.make('z.jpg.tmp.meta',b'{"total": 10}')
+        self.make('junk.txt')
+        album={'id':'a','title':'A','path':self.root,'mediaItems':{'X':{'filename':'x.jpg'}}}
+        issues,files=photo_verify.check_album(album)
+        self.assertEqual(issues['partial'],['y.jpg.tmp','z.jpg.tmp.meta'])
+        self.assertEqual(issues['extra'],['junk.txt'])
+        self.assertEqual([id for id,path,st in files],['X'])
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os,sys
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import storage
+
+# media store with album files linked to its entries
+class StorageTest(unittest.TestCase):
+    def setUp(self):
+        self.root=Path(tempfile.mkdtemp(prefix='test_storage_'))
+        self.store=self.root/'store'
+
+    def tearDown(self):
+        shutil.rmtree(self.root,ignore_errors=True)
+
+    # downloads album file of media and adds it to store
+    def add(self,album,id,data):
+        path=self.root/album/(id+'.jpg')
+        path.parent.mkdir(parents=True,exist_ok=True)
+        path.write_bytes(data)
+        storage.add(self.store,{'id':id,'filename':id+'.jpg'},path,True)
+        return path
+
+    # files left in store
+    def stored(self):
+        return sorted(str(path.relative_to(self.store)) for path in self.store.rglob('*') if path.is_file())
+
+    # content shared by media with the same hash is reclaimed with the last album reference
+    def test_release_shared_content(self):
+        first=self.add('one','AAAA01',b'same')
+        second=self.add('two','BBBB02',b'same')
+        self.assertTrue(os.path.samefile(first,second))
+        self.assertFalse(storage.release(self.store,first,'AAAA01',True))
+        first.unlink()
+        self.assertTrue(storage.release(self.store,second,'BBBB02',True))
+        self.assertEqual(self.stored(),[])
+
+    # content of single media is reclaimed as well
+    def test_release_single(self):
+        path=self.add('one','AAAA01',b'own')
+        self.assertTrue(storage.release(self.store,path,'AAAA01',True))
+        self.assertEqual(self.stored(),[])
+
+    # device of path which is not created yet is device of its parent
+    def test_device_of_missing_path(self):
+        self.assertEqual(storage.device(self.root/'a'/'b'),os.stat(self.root).st_dev)
+
+    # store on another filesystem is rejected before synchronization starts
+    @unittest.skipUnless(os.path.isdir('/dev/shm') and os.stat('/dev/shm').st_dev!=os.stat(tempfile.gettempdir()).st_dev,
+                         'no other filesystem to put store on')
+    def test_store_on_other_device(self):
+        import photo_albums
+        store=tempfile.mkdtemp(prefix='test_store_',dir='/dev/shm')
+        try:
+            self.assertEqual(photo_albums.main(['--store',store,str(self.root/'photos')]),1)
+        finally:
+            shutil.rmtree(store,ignore_errors=True)
+        self.assertFalse((self.root/'photos').exists())
+
+if __name__=='__main__':
+    unittest.main()
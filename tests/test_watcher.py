@@ -0,0 +1,34 @@
+import os,sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import watcher
+
+# watcher runs against temporary directory tree
+class WatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.root=tempfile.mkdtemp(prefix='test_watcher_')
+
+    def tearDown(self):
+        shutil.rmtree(self.root,ignore_errors=True)
+
+    # files which are there before watching starts are reported with the first batch
+    def test_existing_files_reported(self):
+        os.makedirs(os.path.join(self.root,'sub'))
+        paths=[os.path.join(self.root,'a.jpg'),os.path.join(self.root,'sub','b.jpg')]
+        for path in paths:
+            with open(path,'wb') as file:
+                file.write(b'data')
+        modes=[True]+([False] if watcher.load_inotify() is not None else [])
+        for poll in modes:
+            with self.subTest(poll=poll):
+                watch=watcher.watch(self.root,settle=0.05,interval=0.05,poll=poll)
+                try:
+                    self.assertEqual(next(watch),sorted(paths))
+                finally:
+                    watch.close()
+
+if __name__=='__main__':
+    unittest.main()
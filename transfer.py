@@ -0,0 +1,168 @@
+import time
+import threading
+from collections import deque
+from datetime import datetime
+
+# media transfer planning: size estimates of media to download, time-of-day bandwidth limits
+# of streamed bytes and estimated time remaining for queued downloads
+
+# photo bytes per pixel by mime type, others are taken as raw images
+PHOTO_BYTES_PER_PIXEL={'image/jpeg':0.3,'image/heif':0.15,'image/heic':0.15,'image/webp':0.2,'image/gif':0.5,'image/png':1.5}
+RAW_BYTES_PER_PIXEL=1.5
+
+# metadata has no video duration, bytes per frame pixel of typical clip
+VIDEO_BYTES_PER_PIXEL=30
+
+# pixels of media without dimensions
+DEFAULT_PIXELS=12*1000*1000
+
+# estimated media size in bytes from its metadata
+def estimate_size(media):
+    meta=media.get('mediaMetadata',{})
+    try:
+        pixels=int(meta.get('width',0))*int(meta.get('height',0))
+    except (TypeError,ValueError):
+        pixels=0
+    pixels=pixels or DEFAULT_PIXELS
+    mime=media.get('mimeType','')
+    if 'video' in meta or mime.startswith('video/'):
+        return pixels*VIDEO_BYTES_PER_PIXEL
+    return int(pixels*PHOTO_BYTES_PER_PIXEL.get(mime,RAW_BYTES_PER_PIXEL))
+
+# size multipliers of rate suffixes
+UNITS={'':1,'K':1<<10,'M':1<<20,'G':1<<30}
+
+# parses rate in bytes per second with optional K, M or G suffix
+def parse_rate(text):
+    text=text.strip().upper().rstrip('B')
+    rate=float(text[:-1])*UNITS[text[-1]] if text and text[-1] in UNITS else float(text)
+    if rate<=0:
+        raise ValueError('rate must be positive')
+    return rate
+
+# parses minutes of day of HH:MM
+def parse_time(text):
+    hours,_,minutes=text.strip().partition(':')
+    value=int(hours)*60+int(minutes or 0)
+    if not 0<=value<=24*60:
+        raise ValueError('invalid time '+text)
+    return value
+
+# parses bandwidth limits: rate for the whole day or comma separated HH:MM-HH:MM=rate windows,
+# e.g. 09:00-18:00=2M,18:00-23:00=20M, returns list of (start minute, end minute, bytes per second)
+def parse_limits(text):
+    limits=[]
+    for item in text.split(','):
+        window,_,rate=item.rpartition('=')
+        if not window:
+            limits.append((0,24*60,parse_rate(rate)))
+            continue
+        start,_,end=window.partition('-')
+        limits.append((parse_time(start),parse_time(end),parse_rate(rate)))
+    return limits
+
+# token bucket limiting streamed bytes by time-of-day rate
+# bytes are taken in advance and every consumer waits until its debt is paid off
+class Bandwidth:
+    # burst of bytes allowed after idle time, in seconds of rate
+    BURST_SECONDS=1.0
+
+    def __init__(self,limits):
+        self.limits=limits
+        self.lock=threading.Lock()
+        self.tokens=0.0
+        self.stamp=time.monotonic()
+        self.current=None
+
+    # bytes per second limit at local time, None if not limited
+    def rate(self,now=None):
+        now=now or datetime.now()
+        minute=now.hour*60+now.minute
+        for start,end,rate in self.limits:
+            # window may span midnight
+            if start<=minute<end or (end<start and (minute>=start or minute<end)):
+                return rate
+        return None
+
+    # takes bytes from bucket, waits if they go over limit
+    def consume(self,size):
+        with self.lock:
+            rate=self.rate()
+            now=time.monotonic()
+            if rate!=self.current:
+                self.current=rate
+                self.tokens=0.0
+            if rate is None:
+                self.stamp=now
+                return
+            self.tokens=min(rate*self.BURST_SECONDS,self.tokens+(now-self.stamp)*rate)-size
+            self.stamp=now
+            wait=-self.tokens/rate if self.tokens<0 else 0
+        if wait>0:
+            time.sleep(wait)
+
+# queued downloads with their estimated sizes and observed throughput
+class Backlog:
+    # seconds of transfers throughput is measured over
+    WINDOW=60.0
+
+    def __init__(self,bandwidth=None):
+        self.bandwidth=bandwidth
+        self.lock=threading.Lock()
+        self.queued=0
+        self.queued_bytes=0
+        # estimated bytes of finished downloads and bytes they actually transferred
+        self.done_bytes=0
+        self.transferred_bytes=0
+        self.samples=deque()
+
+    # adds queued download
+    def add(self,size):
+        with self.lock:
+            self.queued+=1
+            self.queued_bytes+=size
+
+    # removes finished or abandoned download
+    def done(self,size):
+        with self.lock:
+            self.queued-=1
+            self.queued_bytes-=size
+            self.done_bytes+=size
+
+    # records streamed bytes
+    def transferred(self,size):
+        now=time.monotonic()
+        with self.lock:
+            self.transferred_bytes+=size
+            self.samples.append((now,size))
+            while self.samples and now-self.samples[0][0]>self.WINDOW:
+                self.samples.popleft()
+
+    # bytes per second over last window, None if nothing was transferred
+    def throughput(self):
+        now=time.monotonic()
+        with self.lock:
+            while self.samples and now-self.samples[0][0]>self.WINDOW:
+                self.samples.popleft()
+            if not self.samples:
+                return None
+            elapsed=max(now-self.samples[0][0],1.0)
+            return sum(size for stamp,size in self.samples)/elapsed
+
+    # queued downloads, their bytes corrected by ratio of transferred to estimated bytes and seconds to transfer them
+    def report(self):
+        rate=self.throughput()
+        cap=self.bandwidth.rate() if self.bandwidth is not None else None
+        if rate is not None and cap is not None:
+            rate=min(rate,cap)
+        with self.lock:
+            ratio=self.transferred_bytes/self.done_bytes if self.done_bytes>0 else 1.0
+            remaining=int(self.queued_bytes*ratio)
+            return {'queued':self.queued,'queued_bytes':remaining,
+                    'eta_seconds':round(remaining/rate) if rate else None}
+
+# formats report for logs
+def format_report(report):
+    eta=report['eta_seconds']
+    return 'queued downloads: {0}, ~{1:.1f} MB, {2}'.format(report['queued'],report['queued_bytes']/1e6,
+        'ETA {0}:{1:02d}:{2:02d}'.format(eta//3600,eta//60%60,eta%60) if eta is not None else 'ETA unknown')
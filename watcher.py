@@ -0,0 +1,178 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+
+# watches directory tree for new complete files
+# uses Linux inotify through libc and falls back to polling directory snapshots elsewhere
+
+# inotify event masks
+IN_MODIFY=0x00000002
+IN_CLOSE_WRITE=0x00000008
+IN_MOVED_FROM=0x00000040
+IN_MOVED_TO=0x00000080
+IN_CREATE=0x00000100
+IN_DELETE=0x00000200
+IN_DELETE_SELF=0x00000400
+IN_Q_OVERFLOW=0x00004000
+IN_IGNORED=0x00008000
+IN_ISDIR=0x40000000
+IN_NONBLOCK=0o4000
+IN_CLOEXEC=0o2000000
+
+# watched events of directories
+WATCH_MASK=IN_MODIFY|IN_CLOSE_WRITE|IN_MOVED_FROM|IN_MOVED_TO|IN_CREATE|IN_DELETE|IN_DELETE_SELF
+
+# inotify event header: wd, mask, cookie, name length
+EVENT=struct.Struct('iIII')
+
+# loads libc with inotify functions, None if inotify is not available
+def load_inotify():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+        libc=ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch.argtypes=[ctypes.c_int,ctypes.c_char_p,ctypes.c_uint32]
+        return libc
+    except (OSError,AttributeError):
+        return None
+
+# files of directory tree with their sizes and mtimes
+def snapshot(root,depth=16,skip=None):
+    files={}
+    def scan(path,depth):
+        if depth==0 or path==skip:
+            return
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            scan(entry.path,depth-1)
+                        elif entry.is_file(follow_symlinks=False):
+                            st=entry.stat()
+                            files[entry.path]=(st.st_size,st.st_mtime_ns)
+                    except FileNotFoundError:
+                        pass
+        except (FileNotFoundError,NotADirectoryError):
+            pass
+    scan(root,depth)
+    return files
+
+# yields lists of files which are in root or appeared or changed there and were not written for settle seconds
+# files which are already there are reported too, they were left or put there after import of root
+# skip is directory excluded from watching, e.g. import destination inside source
+def watch(root,settle=2.0,interval=5.0,depth=16,skip=None,poll=False):
+    libc=None if poll else load_inotify()
+    if libc is None:
+        print('inotify is not used,' if poll else 'inotify is not available,','polling',root,'every',interval,'seconds')
+        yield from watch_poll(root,settle,interval,depth,skip)
+    else:
+        yield from watch_inotify(libc,root,settle,depth,skip)
+
+# polls directory snapshots, file is ready when its size and mtime did not change during settle seconds
+def watch_poll(root,settle=2.0,interval=5.0,depth=16,skip=None):
+    known=snapshot(root,depth,skip)
+    now=time.monotonic()
+    pending={path:(state,now) for path,state in known.items()}
+    while True:
+        time.sleep(interval)
+        now=time.monotonic()
+        files=snapshot(root,depth,skip)
+        for path,state in files.items():
+            if known.get(path)!=state:
+                pending[path]=(state,now)
+        known=files
+        ready=[path for path,(state,changed) in pending.items() if path not in files or now-changed>=settle]
+        for path in ready:
+            del pending[path]
+        ready=[path for path in ready if path in files]
+        if ready:
+            yield sorted(ready)
+
+# reacts to inotify close-write and moved-to events, file is ready when it got no events during settle seconds
+def watch_inotify(libc,root,settle=2.0,depth=16,skip=None):
+    fd=libc.inotify_init1(IN_NONBLOCK|IN_CLOEXEC)
+    if fd<0:
+        raise OSError(ctypes_errno(),'inotify_init1 failed')
+    dirs={}
+    pending={}
+    # watches directory tree, files which are already there are reported as new
+    def add_tree(path,level,report):
+        if level==0 or path==skip:
+            return
+        wd=libc.inotify_add_watch(fd,os.fsencode(path),WATCH_MASK)
+        if wd<0:
+            print('can not watch',path,os.strerror(ctypes_errno()))
+            return
+        dirs[wd]=(path,level)
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        add_tree(entry.path,level-1,report)
+                    elif report and entry.is_file(follow_symlinks=False):
+                        pending[entry.path]=time.monotonic()
+        except FileNotFoundError:
+            pass
+    try:
+        add_tree(root,depth,True)
+        while True:
+            now=time.monotonic()
+            timeout=min(pending.values())+settle-now if pending else None
+            readable,_,_=select.select([fd],[],[],max(timeout,0) if timeout is not None else None)
+            if readable:
+                try:
+                    data=os.read(fd,65536)
+                except BlockingIOError:
+                    data=b''
+                now=time.monotonic()
+                offset=0
+                while offset+EVENT.size<=len(data):
+                    wd,mask,cookie,length=EVENT.unpack_from(data,offset)
+                    name=data[offset+EVENT.size:offset+EVENT.size+length].rstrip(b'\0')
+                    offset+=EVENT.size+length
+                    if mask&IN_Q_OVERFLOW:
+                        # events lost, pick up everything in the tree
+                        print('inotify queue overflow, rescanning',root)
+                        for path in snapshot(root,depth,skip):
+                            pending[path]=now
+                        continue
+                    if wd not in dirs:
+                        continue
+                    parent,level=dirs[wd]
+                    if mask&(IN_IGNORED|IN_DELETE_SELF):
+                        dirs.pop(wd,None)
+                        continue
+                    path=os.path.join(parent,os.fsdecode(name))
+                    if mask&IN_ISDIR:
+                        # new directory with whatever was put into it before its watch was added
+                        if mask&(IN_CREATE|IN_MOVED_TO):
+                            add_tree(path,level-1,True)
+                        continue
+                    if mask&(IN_CLOSE_WRITE|IN_MOVED_TO):
+                        pending[path]=now
+                    elif mask&IN_MODIFY and path in pending:
+                        # still being written
+                        pending[path]=now
+                    elif mask&(IN_DELETE|IN_MOVED_FROM):
+                        pending.pop(path,None)
+            now=time.monotonic()
+            ready=sorted(path for path,changed in pending.items() if now-changed>=settle)
+            for path in ready:
+                del pending[path]
+            ready=[path for path in ready if os.path.isfile(path)]
+            if ready:
+                yield ready
+    finally:
+        os.close(fd)
+
+# errno of last failed libc call
+def ctypes_errno():
+    import ctypes
+    return ctypes.get_errno() or errno.EIO
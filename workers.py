@@ -0,0 +1,97 @@
+import heapq
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+# worker threads shared by several clients, e.g. accounts synchronized by one process
+# every client has its own task queue and workers take tasks from client queues round robin
+# so client with many queued tasks does not hold back the others
+# tasks of every client are taken by their priority, lower first, and in submit order within the same priority
+
+# pool of workers serving client queues fairly
+class FairPool:
+    def __init__(self,workers):
+        self.cond=threading.Condition()
+        # client key to heap of its queued tasks
+        self.queues={}
+        self.seq=itertools.count()
+        # keys of clients with queued tasks in round robin order
+        self.order=deque()
+        self.closed=False
+        self.threads=[threading.Thread(target=self.work,daemon=True) for i in range(max(workers,1))]
+        for thread in self.threads:
+            thread.start()
+
+    # queues task of client, returns its future
+    def submit(self,key,fn,*args,priority=0,**kwargs):
+        future=Future()
+        with self.cond:
+            if self.closed:
+                raise RuntimeError('cannot schedule new tasks after shutdown')
+            queue=self.queues.setdefault(key,[])
+            if not queue:
+                self.order.append(key)
+            heapq.heappush(queue,(priority,next(self.seq),(future,fn,args,kwargs)))
+            self.cond.notify()
+        return future
+
+    # takes task of the next client in turn, None once pool is shut down and drained
+    def take(self):
+        with self.cond:
+            while not self.order:
+                if self.closed:
+                    return None
+                self.cond.wait()
+            key=self.order.popleft()
+            queue=self.queues[key]
+            task=heapq.heappop(queue)[2]
+            if queue:
+                self.order.append(key)
+            else:
+                del self.queues[key]
+            return task
+
+    # worker thread
+    def work(self):
+        while True:
+            task=self.take()
+            if task is None:
+                return
+            future,fn,args,kwargs=task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result=fn(*args,**kwargs)
+            except BaseException as error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    # executor-like view of pool for one client
+    def lane(self,key):
+        return Lane(self,key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.shutdown()
+
+    # stops workers after queued tasks are done
+    def shutdown(self,wait=True):
+        with self.cond:
+            self.closed=True
+            self.cond.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+# client view of shared pool with submit() of executor
+class Lane:
+    def __init__(self,pool,key):
+        self.pool=pool
+        self.key=key
+
+    def submit(self,fn,*args,priority=0,**kwargs):
+        return self.pool.submit(self.key,fn,*args,priority=priority,**kwargs)